@@ -0,0 +1,107 @@
+"""
+Checkpoints of the intermediate results of long runs.
+
+Each stage of a run is stored as a compressed .npz file named after a key that hashes the fingerprint of the input
+file, the parameters of that stage and the keys of the stages it depends on. Rerunning with the same input and
+parameters loads the completed stages instead of recomputing them, and runs that differ only in the parameters of a
+later stage (e.g. a sweep over the radius) share the earlier ones.
+"""
+import hashlib
+import os
+import numpy as np
+
+
+def fingerprint(fname, block_size=2 ** 24):
+	"""
+	:return: sha1 of the content of a file
+	"""
+	h = hashlib.sha1()
+	with open(fname, 'rb') as f:
+		block = f.read(block_size)
+		while len(block) > 0:
+			h.update(block)
+			block = f.read(block_size)
+	return h.hexdigest()
+
+
+class Checkpoint:
+	"""
+	Checkpoint of one stage. With directory None, nothing is saved and nothing is ever loaded, so that callers do
+	not need to test whether checkpointing is enabled, except to skip packing the arrays to save.
+	"""
+	def __init__(self, directory, key):
+		self.directory = directory
+		self.key = key
+		if directory is not None and not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def stage(self, name, **params):
+		"""
+		:return: the checkpoint of a stage computed from this one with the given parameters
+		"""
+		description = '%s/%s/%s' % (self.key, name, sorted(params.items()))
+		return Checkpoint(self.directory, '%s-%s' % (name, hashlib.sha1(description.encode('utf-8')).hexdigest()[:16]))
+
+	def enabled(self):
+		"""
+		:return: whether the stage is saved, i.e. whether the arrays passed to save need to be built
+		"""
+		return self.directory is not None
+
+	def path(self):
+		return os.path.join(self.directory, '%s.npz' % self.key)
+
+	def load(self):
+		"""
+		:return: dict of the saved arrays, None if the stage has not been saved yet
+		"""
+		if self.directory is None or not os.path.exists(self.path()):
+			return None
+		with np.load(self.path(), allow_pickle=False) as data:
+			return dict((k, data[k]) for k in data.files)
+
+	def save(self, **arrays):
+		"""
+		Save the arrays of the stage. The file is written under a temporary name then renamed, so that a crash
+		never leaves a truncated checkpoint.
+		"""
+		if self.directory is None:
+			return
+		tmp = self.path() + '.tmp'
+		with open(tmp, 'wb') as f:
+			np.savez_compressed(f, **arrays)
+		os.rename(tmp, self.path())
+
+
+def pack_edges(gedges):
+	"""
+	:param gedges: dict (source, target) -> value
+	:return: dict of arrays to save
+	"""
+	return {'edges': np.array(list(gedges.keys()), dtype=int).reshape(-1, 2), 'values': np.array(list(gedges.values()))}
+
+
+def unpack_edges(data):
+	return dict(zip([tuple(e) for e in data['edges'].tolist()], data['values'].tolist()))
+
+
+def pack_seeds(seeds):
+	return np.array([ss[:3] for ss in seeds], dtype=float).reshape(-1, 3)
+
+
+def unpack_seeds(array):
+	return [tuple(ss) for ss in array.tolist()]
+
+
+def pack_points(datapointwts):
+	"""
+	:param datapointwts: list of (lon, lat, angle, speed, line number, timestamp) as returned by getdata
+	:return: dict of arrays to save
+	"""
+	return {'points': np.array([xx[:4] for xx in datapointwts], dtype=float).reshape(-1, 4),
+			'line': np.array([xx[4] for xx in datapointwts], dtype=int),
+			'timestamp': np.array([xx[5] for xx in datapointwts], dtype=float)}
+
+
+def unpack_points(data):
+	return [tuple(xx) + (j, ts) for xx, j, ts in zip(data['points'].tolist(), data['line'].tolist(), data['timestamp'].tolist())]
@@ -3,6 +3,7 @@ author: rade
 Create the road network by merging trajectories.
 """
 import time, datetime
+import os
 import numpy as np
 import matplotlib
 import getopt
@@ -12,7 +13,10 @@ from geopy.distance import vincenty
 from sklearn.neighbors import NearestNeighbors
 from geojson import MultiLineString
 
-from methods_kharita import getdata, computeclusters, coocurematrix, prunegraph, printedges, plotmap
+from methods_kharita import getdata, computeclusters, coocurematrix, prunegraph, printedges, point2cluster, \
+    splitclustersparallel, printroadwidth
+from checkpoint import Checkpoint, fingerprint, pack_edges, unpack_edges, pack_seeds, unpack_seeds, pack_points, unpack_points
+from mapexport import graph_to_segments, export_tiles, save_preview
 
 if __name__ == '__main__':
     # Default parameters
@@ -26,7 +30,9 @@ if __name__ == '__main__':
     noise_percent = -1
     max_noise_radius = -1
     drawmap = False
-    (opts, args) = getopt.getopt(sys.argv[1:], "f:m:p:r:s:a:d:h")
+    checkpointdir = None
+    vehiclecol = None
+    (opts, args) = getopt.getopt(sys.argv[1:], "f:m:p:r:s:a:c:v:dh")
     for o, a in opts:
         if o == "-f":
             datafile = str(a)
@@ -34,21 +40,60 @@ if __name__ == '__main__':
             SEEDRADIUS = float(a)
         if o == "-s":
             theta = float(a)
+        if o == "-d":
+            drawmap = True
+        if o == "-c":
+            checkpointdir = str(a)
+        if o == "-v":
+            vehiclecol = int(a)
         if o == "-h":
-            print("Usage: python kharita.py [-f <file_name>] [-r <seerdradius>] [-s <theta]")
+            print("Usage: python kharita.py [-f <file_name>] [-r <seerdradius>] [-s <theta] [-c <checkpoint directory>] [-v <vehicle id column>] [-d <export tiles and preview>]")
             exit()
     print('data:', datafile,'theta: ', theta, 'seed radius', SEEDRADIUS)
     nsamples = 20000000;
-    datapointwts = getdata(nsamples, datafile, '2010-10-01', '2015-10-08');
-    print('all datapoints ', len(datapointwts))
-    datapointwts = [xx for xx in datapointwts if xx[3] >= 10]; #filter low speed points
-    print('datapoints with speed>=5kmph: ', len(datapointwts))
-    seeds = computeclusters(datapointwts, 50, SEEDRADIUS,theta); # compute k-means; seeds cluster centroids
+    # every stage is saved in checkpointdir (if given) and reloaded when rerun with the same input and parameters;
+    # the points do not depend on -r and -s, so a sweep over them parses the input once
+    checkpoint = Checkpoint(checkpointdir, fingerprint(datafile) if checkpointdir else '').stage('data', nsamples=nsamples, datestart='2010-10-01', datestr='2015-10-08', minspeed=10, vehiclecol=vehiclecol)
+    state = checkpoint.load()
+    if state is None:
+        datapointwts = getdata(nsamples, datafile, '2010-10-01', '2015-10-08', minspeed=10, vehiclecol=vehiclecol); #filter low speed points
+        if checkpoint.enabled():
+            checkpoint.save(**pack_points(datapointwts))
+    else:
+        datapointwts = unpack_points(state)
+    print('datapoints with speed>=10kmph: ', len(datapointwts))
+    clusterckpt = checkpoint.stage('clusters', SEEDRADIUS=SEEDRADIUS, theta=theta, maxiteration=50)
+    state = clusterckpt.load()
+    if state is None:
+        seeds = computeclusters(datapointwts, 50, SEEDRADIUS,theta,clusterckpt); # compute k-means; seeds cluster centroids
+        cluster, p2cluster = point2cluster(datapointwts, seeds,theta);
+        if clusterckpt.enabled():
+            clusterckpt.save(seeds=pack_seeds(seeds), labels=np.array(p2cluster, dtype=int))
+    else:
+        seeds = unpack_seeds(state['seeds']); p2cluster = state['labels'].tolist();
     print('clusters: ',len(seeds), time.time() - start)
-    gedges = coocurematrix(datapointwts, seeds,theta) # compute connectivity graph
+    edgeckpt = clusterckpt.stage('coocurence')
+    state = edgeckpt.load()
+    if state is None:
+        gedges = coocurematrix(datapointwts, seeds,theta,p2cluster) # compute connectivity graph
+        if edgeckpt.enabled():
+            edgeckpt.save(**pack_edges(gedges))
+    else:
+        gedges = unpack_edges(state)
     print('coocurence matrix computed: ', time.time() - start)
-    gedges = prunegraph(gedges, seeds); # spanner; pruning edges
+    pruneckpt = edgeckpt.stage('prune')
+    state = pruneckpt.load()
+    if state is None:
+        gedges = prunegraph(gedges, seeds); # spanner; pruning edges
+        if pruneckpt.enabled():
+            pruneckpt.save(**pack_edges(gedges))
+    else:
+        gedges = unpack_edges(state)
     print('graph pruning. number of edges = ', len(gedges), time.time() - start)
-    printedges(gedges, seeds, datapointwts,theta);
-    plotmap(seeds, gedges, datapointwts)
+    printedges(gedges, seeds, datapointwts,theta,p2cluster);
+    printroadwidth(seeds, splitclustersparallel(datapointwts, seeds, theta, p2cluster));
+    if drawmap:
+        segments = graph_to_segments(gedges, seeds)
+        export_tiles(segments, '%s_tiles' % os.path.splitext(datafile)[0])
+        save_preview(segments, '%s_preview.png' % os.path.splitext(datafile)[0])
 #    plt.show()
@@ -11,7 +11,9 @@ import getopt
 import datetime
 import networkx as nx
 from scipy.spatial import cKDTree
-from methods import create_trajectories, diffangles, partition_edge, vector_direction_re_north, Cluster
+from methods import create_trajectories, diffangles, partition_edge, vector_direction_re_north, Cluster, DensityGrid, \
+	pack_trajectories, unpack_trajectories, pack_clusters, unpack_clusters, process_trajectory_block
+from checkpoint import Checkpoint, fingerprint
 
 
 if __name__ == '__main__':
@@ -22,7 +24,11 @@ if __name__ == '__main__':
 	FILE_CODE = 'data_uic'
 	DATA_PATH = 'data'
 	drawmap = False
-	(opts, args) = getopt.getopt(sys.argv[1:], "f:m:p:r:s:a:d:h")
+	ADAPTIVE_RADIUS = False # grow the radius and cap the candidates in dense areas.
+	CHECKPOINT_DIR = None
+	CHECKPOINT_PERIOD = 1000 # number of trajectories between two checkpoints.
+	BATCH_SIZE = 0 # number of trajectories processed at once, 0 for the sequential loop.
+	(opts, args) = getopt.getopt(sys.argv[1:], "f:m:p:r:s:a:c:P:b:dAh")
 	for o, a in opts:
 		if o == "-f":
 			FILE_CODE = str(a)
@@ -36,9 +42,17 @@ if __name__ == '__main__':
 			HEADING_ANGLE_TOLERANCE = int(a)
 		if o == "-d":
 			drawmap = True
+		if o == "-A":
+			ADAPTIVE_RADIUS = True
+		if o == "-c":
+			CHECKPOINT_DIR = str(a)
+		if o == "-P":
+			CHECKPOINT_PERIOD = int(a)
+		if o == "-b":
+			BATCH_SIZE = int(a)
 		if o == "-h":
-			print "Usage: python sofa_map.py [-f <file_name>] [-p <file repository>] [-r <clustering_radius>] [-s <sampling_rate>] " \
-				  "[-a <heading angle tolerance>] [-h <help>]\n"
+			print("Usage: python sofa_map.py [-f <file_name>] [-p <file repository>] [-r <clustering_radius>] [-s <sampling_rate>] "
+				  "[-a <heading angle tolerance>] [-A <adaptive radius>] [-c <checkpoint directory>] [-P <checkpoint period>] [-b <batch size>] [-d <export tiles and preview>] [-h <help>]\n")
 			exit()
 
 	RADIUS_DEGREE = RADIUS_METER * 10e-6
@@ -46,14 +60,68 @@ if __name__ == '__main__':
 	clusters = []
 	cluster_kdtree = None
 	roadnet = nx.DiGraph()
+	density_grid = DensityGrid()
+	nb_queries = 0
+	nb_candidates = 0
 	total_points = 0
-	p_X = []
-	p_Y = []
 	starting_time = datetime.datetime.now()
-	trajectories = create_trajectories(INPUT_FILE_NAME= '%s/%s.csv' % (DATA_PATH, FILE_CODE), waiting_threshold=21)
+	# trajectories are shared by all the runs on the same input, the map state is saved every CHECKPOINT_PERIOD trajectories.
+	INPUT_FILE_NAME = '%s/%s.csv' % (DATA_PATH, FILE_CODE)
+	checkpoint = Checkpoint(CHECKPOINT_DIR, fingerprint(INPUT_FILE_NAME) if CHECKPOINT_DIR else '')
+	trajectories_checkpoint = checkpoint.stage('trajectories', waiting_threshold=21)
+	state = trajectories_checkpoint.load()
+	if state is None:
+		trajectories = create_trajectories(INPUT_FILE_NAME=INPUT_FILE_NAME, waiting_threshold=21)
+		if trajectories_checkpoint.enabled():
+			trajectories_checkpoint.save(**pack_trajectories(trajectories))
+	else:
+		trajectories = unpack_trajectories(state)
+	map_checkpoint = trajectories_checkpoint.stage('map', radius=RADIUS_METER, sampling=SAMPLING_DISTANCE,
+												   heading=HEADING_ANGLE_TOLERANCE,
+												   adaptive=(density_grid.max_factor, density_grid.max_candidates) if ADAPTIVE_RADIUS else False,
+												   batched=BATCH_SIZE > 0)
+	start_index = 0
+	state = map_checkpoint.load()
+	if state is not None:
+		clusters = unpack_clusters(state)
+		roadnet.add_nodes_from(range(len(clusters)))
+		roadnet.add_edges_from([tuple(e) for e in state['edges'].tolist()])
+		if ADAPTIVE_RADIUS:
+			density_grid.set_state(state)
+		nb_queries, nb_candidates = int(state['nb_queries']), int(state['nb_candidates'])
+		total_points = int(state['total_points'])
+		start_index = int(state['next_trajectory'])
+		if len(clusters) > 0:
+			cluster_kdtree = cKDTree([c.get_lonlat() for c in clusters])
+	resumed_points = total_points
+
+	def save_map_checkpoint(next_trajectory):
+		state = pack_clusters(clusters)
+		state.update(density_grid.get_state())
+		map_checkpoint.save(edges=np.array(list(roadnet.edges()), dtype=int).reshape(-1, 2), next_trajectory=next_trajectory,
+							nb_queries=nb_queries, nb_candidates=nb_candidates, total_points=total_points, **state)
 
 	starting_time = datetime.datetime.now()
-	for i, trajectory in enumerate(trajectories[:-1]):
+	# batched mode: blocks of trajectories are matched at once (see process_trajectory_block), with the same result as
+	# the sequential loop, which then has nothing left to process.
+	hole_cache = {}
+	while BATCH_SIZE > 0 and start_index < len(trajectories) - 1:
+		end_index = min(start_index + BATCH_SIZE, len(trajectories) - 1)
+		sys.stdout.write('\rprocessing trajectory: %s / %s' % (end_index, len(trajectories)))
+		sys.stdout.flush()
+		block = trajectories[start_index:end_index]
+		total_points += sum(len(trajectory) for trajectory in block)
+		block_queries, block_candidates = process_trajectory_block(block, clusters, roadnet, cluster_kdtree, RADIUS_DEGREE,
+			SAMPLING_DISTANCE, HEADING_ANGLE_TOLERANCE, density_grid if ADAPTIVE_RADIUS else None, hole_cache)
+		nb_queries += block_queries
+		nb_candidates += block_candidates
+		if len(clusters) > 0:
+			cluster_kdtree = cKDTree([c.get_lonlat() for c in clusters])
+		if CHECKPOINT_DIR and (end_index // CHECKPOINT_PERIOD > start_index // CHECKPOINT_PERIOD or end_index == len(trajectories) - 1):
+			save_map_checkpoint(end_index)
+		start_index = end_index
+
+	for i, trajectory in enumerate(trajectories[start_index:-1], start_index):
 		sys.stdout.write('\rprocessing trajectory: %s / %s' % (i,len(trajectories)))
 		sys.stdout.flush()
 		update_cluster_index = False
@@ -61,8 +129,11 @@ if __name__ == '__main__':
 		current_cluster = -1
 		first_edge = True
 		for point in trajectory:
-			p_X.append(point.lon)
-			p_Y.append(point.lat)
+			total_points += 1
+			radius = RADIUS_DEGREE
+			if ADAPTIVE_RADIUS:
+				density_grid.add(point)
+				radius = RADIUS_DEGREE * density_grid.radius_factor(point.lon, point.lat)
 			# very first case: enter only once
 			if len(clusters) == 0:
 				# create a new cluster
@@ -75,8 +146,12 @@ if __name__ == '__main__':
 				cluster_kdtree = cKDTree([c.get_lonlat() for c in clusters])
 				continue
 			# if there's a cluster within x meters and y angle: add to. Else: create new cluster
-			close_clusters_indices = [clu_index for clu_index in cluster_kdtree.query_ball_point(x=point.get_lonlat(), r=RADIUS_DEGREE, p=2)
+			close_clusters_indices = [clu_index for clu_index in cluster_kdtree.query_ball_point(x=point.get_lonlat(), r=radius, p=2)
 									  if math.fabs(diffangles(point.angle, clusters[clu_index].angle)) <= HEADING_ANGLE_TOLERANCE ]
+			if ADAPTIVE_RADIUS:
+				close_clusters_indices = density_grid.nearest_candidates(point.get_lonlat(), close_clusters_indices, clusters)
+			nb_queries += 1
+			nb_candidates += len(close_clusters_indices)
 
 			if len(close_clusters_indices) == 0:
 				# create a new cluster
@@ -91,7 +166,8 @@ if __name__ == '__main__':
 				pt = geopy.Point(point.get_coordinates())
 				close_clusters_distances = [geopy.distance.distance(pt, geopy.Point(clusters[clu_index].get_coordinates())).meters
 											for clu_index in close_clusters_indices]
-				closest_cluster_indx = close_clusters_indices[close_clusters_distances.index(min(close_clusters_distances))]
+				# ties go to the lowest cluster index, whatever the order of the KD-tree.
+				closest_cluster_indx = min(zip(close_clusters_distances, close_clusters_indices))[1]
 				clusters[closest_cluster_indx].add(point)
 				current_cluster = closest_cluster_indx
 			# Adding the edge:
@@ -105,9 +181,16 @@ if __name__ == '__main__':
 			# Check if the newly created points belong to any existing cluster:
 			intermediate_cluster_ids = []
 			for pt in intermediate_clusters:
+				pt_radius = RADIUS_DEGREE
+				if ADAPTIVE_RADIUS:
+					pt_radius = RADIUS_DEGREE * density_grid.radius_factor(pt.lon, pt.lat)
 				close_clusters_indices = [clu_index for clu_index in
-										  cluster_kdtree.query_ball_point(x=pt.get_lonlat(), r=RADIUS_DEGREE, p=2)
+										  cluster_kdtree.query_ball_point(x=pt.get_lonlat(), r=pt_radius, p=2)
 										  if math.fabs(diffangles(pt.angle, clusters[clu_index].angle)) <= HEADING_ANGLE_TOLERANCE]
+				if ADAPTIVE_RADIUS:
+					close_clusters_indices = density_grid.nearest_candidates(pt.get_lonlat(), close_clusters_indices, clusters)
+				nb_queries += 1
+				nb_candidates += len(close_clusters_indices)
 
 				if len(close_clusters_indices) == 0:
 					intermediate_cluster_ids.append(-1)
@@ -118,7 +201,7 @@ if __name__ == '__main__':
 					close_clusters_distances = [
 						geopy.distance.distance(PT, geopy.Point(clusters[clu_index].get_coordinates())).meters for clu_index
 						in close_clusters_indices]
-					closest_cluster_indx = close_clusters_indices[close_clusters_distances.index(min(close_clusters_distances))]
+					closest_cluster_indx = min(zip(close_clusters_distances, close_clusters_indices))[1]
 					intermediate_cluster_ids.append(closest_cluster_indx)
 
 			# For each element is segment: if ==-1 create new cluster and link to it, else link to the corresponding cluster
@@ -151,17 +234,19 @@ if __name__ == '__main__':
 			prev_cluster = current_cluster
 		if update_cluster_index:
 			cluster_kdtree = cKDTree([c.get_lonlat() for c in clusters])
+		if CHECKPOINT_DIR and ((i + 1) % CHECKPOINT_PERIOD == 0 or i == len(trajectories) - 2):
+			save_map_checkpoint(i + 1)
 	exec_time = datetime.datetime.now() - starting_time
 	with open('%s/%s_edges.txt' % (DATA_PATH, FILE_CODE), 'w') as fout:
 		for s, t in roadnet.edges():
 			fout.write('%s,%s\n%s,%s\n\n' % (clusters[s].lon, clusters[s].lat, clusters[t].lon, clusters[t].lat))
-	print 'Graph generated in %s seconds' % exec_time.seconds
+	print('Graph generated in %s seconds' % exec_time.seconds)
+	# trade-off between latency and map size: compare these figures with and without -A.
+	print('clusters: %s, edges: %s, candidate clusters compared per query: %.2f, ms per point: %.3f' %
+		  (len(clusters), roadnet.number_of_edges(), float(nb_candidates) / max(1, nb_queries),
+		   1000.0 * exec_time.total_seconds() / max(1, total_points - resumed_points)))
 	if drawmap:
-		from matplotlib import collections as mc, pyplot as plt
-		lines = [[clusters[s].get_lonlat(), clusters[t].get_lonlat()] for s, t in roadnet.edges()]
-		lc = mc.LineCollection(lines)
-		fig, ax = plt.subplots()
-		ax.add_collection(lc)
-		ax.autoscale()
-		ax.margins(0.1)
-		plt.show()
\ No newline at end of file
+		from mapexport import export_tiles, save_preview
+		segments = np.array([clusters[s].get_lonlat() + clusters[t].get_lonlat() for s, t in roadnet.edges()]).reshape(-1, 4)
+		export_tiles(segments, '%s/%s_tiles' % (DATA_PATH, FILE_CODE))
+		save_preview(segments, '%s/%s_preview.png' % (DATA_PATH, FILE_CODE))
\ No newline at end of file
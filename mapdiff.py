@@ -0,0 +1,363 @@
+"""
+Stable node identifiers and diffs between two inferred maps.
+
+Every run of kharita.py / kharita_star.py numbers its clusters from scratch, so two maps built from
+overlapping data cannot be compared by cluster id. Here nodes are named after the spatial cell
+(and heading bucket) they fall in, the nodes of the new map are matched to the nodes of the old map
+with a KD-tree, and the edges are compared on the matched ids. The result is a small delta file
+that can be applied to the old map to obtain the new one.
+
+To chain deltas, the ids must be carried over from one diff to the next: -m keeps the map as the consumer
+holds it after applying the deltas (with its ids), diffs against it and updates it.
+
+Usage:
+python mapdiff.py -o data/data_uic_edges_old.txt -n data/data_uic_edges.txt -f data/data_uic_delta.txt -t 10
+python mapdiff.py -o day1_edges.txt -n day2_edges.txt -m map_ids.txt -f delta_1_2.txt
+python mapdiff.py -n day3_edges.txt -m map_ids.txt -f delta_2_3.txt
+"""
+import getopt
+import math
+import os
+import sys
+import numpy as np
+from scipy.spatial import cKDTree
+
+METERS_PER_DEGREE = 111320.0
+NODE_ID_PRECISION = 5  # size in meters of the cells used to derive the node ids.
+HEADING_BUCKET = 45  # width in degrees of the heading buckets used to derive the node ids.
+MATCH_TOLERANCE = 10  # max distance in meters between two nodes considered to be the same.
+MATCH_ANGLE_TOLERANCE = 60
+
+
+def node_id(lon, lat, angle=None, precision=NODE_ID_PRECISION):
+	"""
+	Derive an identifier from the position (and heading) of a node. The same location always gets the same id,
+	whatever the run that produced it.
+	:param lon: longitude
+	:param lat: latitude
+	:param angle: heading in degrees, None if unknown
+	:param precision: cell size in meters
+	:return: string id: <lat cell>:<lon cell>[:<heading bucket>]
+	"""
+	lat_cell = int(math.floor(lat * METERS_PER_DEGREE / precision))
+	lon_cell = int(math.floor(lon * METERS_PER_DEGREE * math.cos(math.radians(lat_cell * precision / METERS_PER_DEGREE)) / precision))
+	if angle is None:
+		return '%s:%s' % (lat_cell, lon_cell)
+	return '%s:%s:%s' % (lat_cell, lon_cell, int((angle % 360) // HEADING_BUCKET))
+
+
+def read_edges(fname):
+	"""
+	Read the edges of a map. Supports both the output of kharita_star.py (blocks of two 'lon,lat' lines)
+	and the output of kharita.py (one 'lon lat angle lon lat angle speed speed' line per edge).
+	:param fname: the edges file
+	:return: list of edges (source, target, attributes), where source and target are (lon, lat, angle) tuples
+	"""
+	edges = []
+	block = []
+	with open(fname, 'r') as f:
+		for line in f:
+			line = line.strip()
+			if len(line) == 0:
+				block = []
+				continue
+			if ',' in line:
+				lon, lat = line.split(',')
+				block.append((float(lon), float(lat), None))
+				if len(block) == 2:
+					edges.append((block[0], block[1], ()))
+					block = []
+			else:
+				zz = line.split(' ')
+				edges.append(((float(zz[0]), float(zz[1]), float(zz[2])), (float(zz[3]), float(zz[4]), float(zz[5])),
+							  tuple(int(float(xx)) for xx in zz[6:])))
+	return edges
+
+
+def _nodes(edges):
+	"""
+	:return: list of the distinct nodes of a list of edges, and a dict node -> index in that list
+	"""
+	nodes = sorted(set([e[0] for e in edges] + [e[1] for e in edges]), key=lambda n: (n[0], n[1], n[2] is not None and n[2]))
+	return nodes, dict((n, i) for i, n in enumerate(nodes))
+
+
+def _assign_ids(nodes, precision):
+	"""
+	Spatial ids for a list of nodes; ids that collide within the same map get a suffix.
+	"""
+	ids = []
+	seen = {}
+	for n in nodes:
+		nid = node_id(n[0], n[1], n[2], precision)
+		seen[nid] = seen.get(nid, -1) + 1
+		ids.append(nid if seen[nid] == 0 else '%s.%s' % (nid, seen[nid]))
+	return ids
+
+
+def _project(nodes, lat0):
+	"""
+	Equirectangular projection of the nodes in meters around latitude lat0.
+	"""
+	xy = np.array([(n[0], n[1]) for n in nodes], dtype=float).reshape(-1, 2)
+	xy[:, 0] *= METERS_PER_DEGREE * math.cos(math.radians(lat0))
+	xy[:, 1] *= METERS_PER_DEGREE
+	return xy
+
+
+def match_nodes(old_nodes, new_nodes, tolerance=MATCH_TOLERANCE, angle_tolerance=MATCH_ANGLE_TOLERANCE):
+	"""
+	One to one matching of the nodes of the new map to the nodes of the old map: among the pairs of nodes within
+	tolerance meters and heading angle_tolerance, closest pairs are matched first. A new node whose nearest old node
+	is taken or heads the other way (the other direction of a two-way road) goes on with its next old nodes.
+	:return: array with, for each new node, the index of the matched old node or -1
+	"""
+	matches = -np.ones(len(new_nodes), dtype=int)
+	if len(old_nodes) == 0 or len(new_nodes) == 0:
+		return matches
+	lat0 = np.mean([n[1] for n in old_nodes])
+	old_xy = _project(old_nodes, lat0)
+	new_xy = _project(new_nodes, lat0)
+	neighbors = cKDTree(old_xy).query_ball_point(new_xy, r=tolerance)
+	pairs = [(i, j) for i, nn in enumerate(neighbors) for j in nn]
+	if len(pairs) == 0:
+		return matches
+	new_index, old_index = np.array(pairs, dtype=int).T
+	a1 = np.array([np.nan if n[2] is None else n[2] for n in new_nodes], dtype=float)[new_index]
+	a2 = np.array([np.nan if n[2] is None else n[2] for n in old_nodes], dtype=float)[old_index]
+	# pairs with an unknown heading are compatible.
+	ok = ~(180 - np.abs(np.abs(a1 - a2) % 360 - 180) > angle_tolerance)
+	new_index, old_index = new_index[ok], old_index[ok]
+	distances = np.hypot(*(new_xy[new_index] - old_xy[old_index]).T)
+	taken = np.zeros(len(old_nodes), dtype=bool)
+	for k in np.lexsort((old_index, new_index, distances)):
+		i, j = new_index[k], old_index[k]
+		if matches[i] >= 0 or taken[j]:
+			continue
+		taken[j] = True
+		matches[i] = j
+	return matches
+
+
+def _indexed_nodes(indexed_edges):
+	"""
+	:return: the ids of the nodes of a map indexed by index_edges, and the position of each id. An id whose edges
+	were moved by earlier deltas takes the position of its first edge in key order.
+	"""
+	positions = {}
+	for sid, tid in sorted(indexed_edges):
+		s, t, a = indexed_edges[(sid, tid)]
+		positions.setdefault(sid, s)
+		positions.setdefault(tid, t)
+	ids = sorted(positions)
+	return ids, [positions[nid] for nid in ids]
+
+
+def diff_maps(old_edges, new_edges, tolerance=MATCH_TOLERANCE, precision=NODE_ID_PRECISION):
+	"""
+	Compare two maps.
+	:param old_edges: edges of the reference map, either as returned by read_edges or already indexed by ids (as
+	returned by index_edges, apply_delta or read_map). Chained deltas must be computed against the indexed map the
+	consumer holds, so that they use the ids the consumer knows.
+	:param new_edges: edges of the new map, as returned by read_edges
+	:param tolerance: nodes of the two maps closer than tolerance meters are considered to be the same node
+	:param precision: cell size in meters of the node ids
+	:return: dict with the 'added', 'removed' and 'changed' edges as (source id, target id, source, target, attributes).
+	Changed edges are edges present in both maps whose attributes changed or whose end points moved by more than
+	precision meters. Ids of the matched nodes are the ids of the old map.
+	"""
+	old = old_edges if isinstance(old_edges, dict) else index_edges(old_edges, precision)
+	old_ids, old_nodes = _indexed_nodes(old)
+	new_nodes, new_index = _nodes(new_edges)
+	new_ids = _assign_ids(new_nodes, precision)
+	matches = match_nodes(old_nodes, new_nodes, tolerance)
+	taken = set(old_ids)
+	for i, j in enumerate(matches):
+		if j >= 0:
+			new_ids[i] = old_ids[j]
+	for i, j in enumerate(matches):
+		if j < 0:
+			# an unmatched node falling in the cell of an old node must not take over its id.
+			while new_ids[i] in taken:
+				new_ids[i] = '%s+' % new_ids[i]
+			taken.add(new_ids[i])
+
+	new = dict(((new_ids[new_index[s]], new_ids[new_index[t]]), (s, t, a)) for s, t, a in new_edges)
+	delta = {'added': [], 'removed': [], 'changed': []}
+	lat0 = np.mean([n[1] for n in old_nodes]) if len(old_nodes) > 0 else 0
+	for key in sorted(new):
+		s, t, a = new[key]
+		if key not in old:
+			delta['added'].append(key + (s, t, a))
+			continue
+		old_s, old_t, old_a = old[key]
+		moved = np.max(np.hypot(*(_project([s, t], lat0) - _project([old_s, old_t], lat0)).T))
+		if a != old_a or moved > precision:
+			delta['changed'].append(key + (s, t, a))
+	for key in sorted(old):
+		if key not in new:
+			s, t, a = old[key]
+			delta['removed'].append(key + (s, t, a))
+	_match_edges(delta, lat0, tolerance)
+	return delta
+
+
+def _match_edges(delta, lat0, tolerance):
+	"""
+	Dense maps have nodes only a few meters apart, so node matching alone leaves some edges that merely moved
+	reported as removed and added. Pair such edges on the position of both their end points and report them
+	as changed, keeping the ids of the old edge.
+	"""
+	if len(delta['added']) == 0 or len(delta['removed']) == 0:
+		return
+	def segments(edges):
+		return np.hstack([_project([e[2] for e in edges], lat0), _project([e[3] for e in edges], lat0)])
+	distances, indices = cKDTree(segments(delta['removed'])).query(segments(delta['added']), k=1,
+																   distance_upper_bound=tolerance * math.sqrt(2))
+	taken = np.zeros(len(delta['removed']), dtype=bool)
+	paired = np.zeros(len(delta['added']), dtype=bool)
+	for i in np.argsort(distances, kind='mergesort'):
+		if np.isinf(distances[i]):
+			break
+		j = indices[i]
+		if taken[j]:
+			continue
+		taken[j] = True
+		paired[i] = True
+		sid, tid, s, t, a = delta['added'][i]
+		delta['changed'].append(delta['removed'][j][:2] + (s, t, a))
+	delta['added'] = [e for i, e in enumerate(delta['added']) if not paired[i]]
+	delta['removed'] = [e for j, e in enumerate(delta['removed']) if not taken[j]]
+	delta['changed'].sort(key=lambda e: e[:2])
+
+
+def _format_node(n):
+	return '%s %s %s' % (n[0], n[1], '-' if n[2] is None else n[2])
+
+
+def _parse_node(zz):
+	return (float(zz[0]), float(zz[1]), None if zz[2] == '-' else float(zz[2]))
+
+
+def write_delta(delta, fname):
+	"""
+	Write a delta in a compact text format, one edge per line:
+	'+ sid tid slon slat sangle tlon tlat tangle attributes' for added edges, '~ ...' for changed edges,
+	'- sid tid' for removed edges.
+	"""
+	with open(fname, 'w') as fout:
+		for op, kind in (('-', 'removed'), ('+', 'added'), ('~', 'changed')):
+			for sid, tid, s, t, a in delta[kind]:
+				if op == '-':
+					fout.write('- %s %s\n' % (sid, tid))
+				else:
+					fout.write(' '.join([op, sid, tid, _format_node(s), _format_node(t)] + [str(xx) for xx in a]) + '\n')
+
+
+def read_delta(fname):
+	"""
+	Read a delta written by write_delta. Removed edges only carry their ids.
+	"""
+	delta = {'added': [], 'removed': [], 'changed': []}
+	kinds = {'+': 'added', '-': 'removed', '~': 'changed'}
+	with open(fname, 'r') as f:
+		for line in f:
+			zz = line.split()
+			if len(zz) == 0:
+				continue
+			if zz[0] == '-':
+				delta['removed'].append((zz[1], zz[2], None, None, ()))
+			else:
+				delta[kinds[zz[0]]].append((zz[1], zz[2], _parse_node(zz[3:6]), _parse_node(zz[6:9]),
+											tuple(int(xx) for xx in zz[9:])))
+	return delta
+
+
+def index_edges(edges, precision=NODE_ID_PRECISION):
+	"""
+	Key the edges of a map by the ids of their end points.
+	:return: dict (source id, target id) -> (source, target, attributes)
+	"""
+	nodes, index = _nodes(edges)
+	ids = _assign_ids(nodes, precision)
+	return dict(((ids[index[s]], ids[index[t]]), (s, t, a)) for s, t, a in edges)
+
+
+def apply_delta(indexed_edges, delta):
+	"""
+	Apply a delta in place to a map indexed by index_edges. The delta must have been computed against that same
+	map: a removed or changed edge the map does not have, or an added edge it already has, raises a KeyError.
+	:return: the updated map
+	"""
+	for sid, tid, s, t, a in delta['removed']:
+		if (sid, tid) not in indexed_edges:
+			raise KeyError('removed edge %s %s is not in the map' % (sid, tid))
+	for sid, tid, s, t, a in delta['changed']:
+		if (sid, tid) not in indexed_edges:
+			raise KeyError('changed edge %s %s is not in the map' % (sid, tid))
+	for sid, tid, s, t, a in delta['added']:
+		if (sid, tid) in indexed_edges:
+			raise KeyError('added edge %s %s is already in the map' % (sid, tid))
+	for sid, tid, s, t, a in delta['removed']:
+		del indexed_edges[(sid, tid)]
+	for kind in ('added', 'changed'):
+		for sid, tid, s, t, a in delta[kind]:
+			indexed_edges[(sid, tid)] = (s, t, a)
+	return indexed_edges
+
+
+def write_map(indexed_edges, fname):
+	"""
+	Write a map indexed by ids, one 'sid tid slon slat sangle tlon tlat tangle attributes' line per edge, so that the
+	ids can be carried over to the next diff.
+	"""
+	with open(fname, 'w') as fout:
+		for sid, tid in sorted(indexed_edges):
+			s, t, a = indexed_edges[(sid, tid)]
+			fout.write(' '.join([sid, tid, _format_node(s), _format_node(t)] + [str(xx) for xx in a]) + '\n')
+
+
+def read_map(fname):
+	"""
+	Read a map written by write_map.
+	:return: dict (source id, target id) -> (source, target, attributes)
+	"""
+	indexed_edges = {}
+	with open(fname, 'r') as f:
+		for line in f:
+			zz = line.split()
+			if len(zz) == 0:
+				continue
+			indexed_edges[(zz[0], zz[1])] = (_parse_node(zz[2:5]), _parse_node(zz[5:8]), tuple(int(xx) for xx in zz[8:]))
+	return indexed_edges
+
+
+if __name__ == '__main__':
+	OLD_FILE = None
+	NEW_FILE = None
+	MAP_FILE = None
+	DELTA_FILE = 'delta.txt'
+	TOLERANCE = MATCH_TOLERANCE
+	(opts, args) = getopt.getopt(sys.argv[1:], "o:n:m:f:t:h")
+	for o, a in opts:
+		if o == "-o":
+			OLD_FILE = str(a)
+		if o == "-n":
+			NEW_FILE = str(a)
+		if o == "-m":
+			MAP_FILE = str(a)
+		if o == "-f":
+			DELTA_FILE = str(a)
+		if o == "-t":
+			TOLERANCE = float(a)
+	has_map = MAP_FILE is not None and os.path.exists(MAP_FILE)
+	if (OLD_FILE is None and not has_map) or NEW_FILE is None or ("-h", "") in opts:
+		print("Usage: python mapdiff.py [-o <old edges file>] -n <new edges file> [-m <indexed map file>] "
+			  "[-f <delta file>] [-t <matching tolerance in meters>] [-h <help>]")
+		exit()
+	old = read_map(MAP_FILE) if has_map else index_edges(read_edges(OLD_FILE))
+	delta = diff_maps(old, read_edges(NEW_FILE), tolerance=TOLERANCE)
+	write_delta(delta, DELTA_FILE)
+	if MAP_FILE is not None:
+		write_map(apply_delta(old, delta), MAP_FILE)
+	print('added: %s, removed: %s, changed: %s' % (len(delta['added']), len(delta['removed']), len(delta['changed'])))
@@ -0,0 +1,158 @@
+"""
+Headless export of an inferred map: chunked GeoJSON per web mercator tile (z/x/y.geojson), with a simplified
+level of detail below the highest zoom, and a raster preview rendered with numpy.
+
+Usage:
+python mapexport.py -i data/data_uic_edges.txt -o data/data_uic_tiles -z 12 -Z 17 -r data/data_uic_preview.png
+"""
+import getopt
+import json
+import math
+import os
+import sys
+import numpy as np
+
+TILE_SIZE = 256  # pixels per tile side, used to pick the simplification grid of each zoom level.
+
+
+def edges_to_segments(edges):
+	"""
+	:param edges: list of (source, target, ...) where source and target start with lon, lat
+	:return: (n, 4) array of lon1, lat1, lon2, lat2
+	"""
+	return np.array([(s[0], s[1], t[0], t[1]) for s, t in [e[:2] for e in edges]], dtype=float).reshape(-1, 4)
+
+
+def graph_to_segments(gedges, seeds):
+	"""
+	Segments of the graph produced by kharita.py: gedges keyed by (seed index, seed index).
+	"""
+	S = np.array([ss[:2] for ss in seeds], dtype=float).reshape(-1, 2)
+	E = np.array(list(gedges), dtype=int).reshape(-1, 2)
+	return np.hstack([S[E[:, 0]], S[E[:, 1]]])
+
+
+def tile_xy(lon, lat, zoom):
+	"""
+	Web mercator (slippy map) tile indices of arrays of positions.
+	"""
+	n = 2 ** zoom
+	x = np.floor((np.asarray(lon) + 180.0) / 360.0 * n).astype(int)
+	lat_rad = np.radians(np.asarray(lat))
+	y = np.floor((1.0 - np.arcsinh(np.tan(lat_rad)) / math.pi) / 2.0 * n).astype(int)
+	return x.clip(0, n - 1), y.clip(0, n - 1)
+
+
+def simplify(segments, zoom):
+	"""
+	Level of detail for a zoom level: end points are snapped to a grid of about one pixel at that zoom, and
+	segments that become degenerate or duplicate (in either direction) are dropped.
+	"""
+	step = 360.0 / (2 ** zoom * TILE_SIZE)
+	snapped = np.round(segments / step)
+	snapped = snapped[(snapped[:, 0] != snapped[:, 2]) | (snapped[:, 1] != snapped[:, 3])]
+	# undirected: order the end points before removing duplicates.
+	swap = (snapped[:, 0] > snapped[:, 2]) | ((snapped[:, 0] == snapped[:, 2]) & (snapped[:, 1] > snapped[:, 3]))
+	snapped[swap] = snapped[swap][:, [2, 3, 0, 1]]
+	return np.unique(snapped, axis=0) * step
+
+
+def export_tiles(segments, out_dir, min_zoom=12, max_zoom=17):
+	"""
+	Write the segments as one GeoJSON MultiLineString per tile, in out_dir/z/x/y.geojson. A segment goes to the
+	tiles of both its end points. Zoom levels below max_zoom use simplify.
+	:return: number of tiles written
+	"""
+	nb_tiles = 0
+	for zoom in range(min_zoom, max_zoom + 1):
+		segs = segments if zoom == max_zoom else simplify(segments, zoom)
+		if len(segs) == 0:
+			continue
+		x1, y1 = tile_xy(segs[:, 0], segs[:, 1], zoom)
+		x2, y2 = tile_xy(segs[:, 2], segs[:, 3], zoom)
+		index = np.concatenate([np.arange(len(segs)), np.arange(len(segs))])
+		tiles = np.column_stack([np.concatenate([x1, x2]), np.concatenate([y1, y2]), index])
+		tiles = np.unique(tiles, axis=0)  # sorted by x, y, then segment
+		keys = tiles[:, 0] * (2 ** zoom) + tiles[:, 1]
+		bounds = np.flatnonzero(np.diff(keys)) + 1
+		for chunk in np.split(tiles, bounds):
+			x, y = chunk[0, 0], chunk[0, 1]
+			tile_dir = os.path.join(out_dir, str(zoom), str(x))
+			if not os.path.isdir(tile_dir):
+				os.makedirs(tile_dir)
+			lines = segs[chunk[:, 2]].reshape(-1, 2, 2).tolist()
+			with open(os.path.join(tile_dir, '%s.geojson' % y), 'w') as fout:
+				json.dump({'type': 'Feature', 'properties': {'z': zoom, 'x': int(x), 'y': int(y)},
+						   'geometry': {'type': 'MultiLineString', 'coordinates': lines}}, fout)
+			nb_tiles += 1
+	return nb_tiles
+
+
+def rasterize(segments, width=2048):
+	"""
+	Draw the segments into an image array: every segment is sampled once per pixel along its longest axis, and
+	all samples are accumulated at once.
+	:param width: size in pixels of the longest side of the image
+	:return: (height, width) array with the number of samples per pixel, north up
+	"""
+	if len(segments) == 0:
+		return np.zeros((1, width))
+	lon = segments[:, [0, 2]]
+	lat = segments[:, [1, 3]]
+	lon_min, lon_max, lat_min, lat_max = lon.min(), lon.max(), lat.min(), lat.max()
+	aspect = math.cos(math.radians((lat_min + lat_max) / 2))
+	scale = (width - 1) / max((lon_max - lon_min) * aspect, lat_max - lat_min, 1e-12)
+	height = int(round((lat_max - lat_min) * scale)) + 1
+	width = int(round((lon_max - lon_min) * aspect * scale)) + 1
+	px = (lon - lon_min) * aspect * scale
+	py = (lat_max - lat) * scale
+	nb = (np.maximum(np.abs(px[:, 1] - px[:, 0]), np.abs(py[:, 1] - py[:, 0])).astype(int) + 1)
+	seg = np.repeat(np.arange(len(segments)), nb)
+	offsets = np.arange(nb.sum()) - np.repeat(np.cumsum(nb) - nb, nb)
+	t = offsets / np.maximum(nb - 1, 1)[seg].astype(float)
+	x = np.round(px[seg, 0] + t * (px[seg, 1] - px[seg, 0])).astype(int).clip(0, width - 1)
+	y = np.round(py[seg, 0] + t * (py[seg, 1] - py[seg, 0])).astype(int).clip(0, height - 1)
+	return np.bincount(y * width + x, minlength=height * width).reshape(height, width)
+
+
+def save_preview(segments, fname, width=2048):
+	"""
+	Render the segments with rasterize and save them as an image (format from the file extension).
+	"""
+	from matplotlib import image
+	img = rasterize(segments, width)
+	image.imsave(fname, np.log1p(img), cmap='gray_r')
+	return img
+
+
+if __name__ == '__main__':
+	from mapdiff import read_edges
+	INPUT_FILE = None
+	OUT_DIR = None
+	PREVIEW_FILE = None
+	MIN_ZOOM = 12
+	MAX_ZOOM = 17
+	WIDTH = 2048
+	(opts, args) = getopt.getopt(sys.argv[1:], "i:o:z:Z:r:w:h")
+	for o, a in opts:
+		if o == "-i":
+			INPUT_FILE = str(a)
+		if o == "-o":
+			OUT_DIR = str(a)
+		if o == "-z":
+			MIN_ZOOM = int(a)
+		if o == "-Z":
+			MAX_ZOOM = int(a)
+		if o == "-r":
+			PREVIEW_FILE = str(a)
+		if o == "-w":
+			WIDTH = int(a)
+	if INPUT_FILE is None or ("-h", "") in opts:
+		print("Usage: python mapexport.py -i <edges file> [-o <tiles directory>] [-z <min zoom>] [-Z <max zoom>] "
+			  "[-r <preview image>] [-w <preview width>] [-h <help>]")
+		exit()
+	segments = edges_to_segments(read_edges(INPUT_FILE))
+	if OUT_DIR is not None:
+		print('tiles written: %s' % export_tiles(segments, OUT_DIR, MIN_ZOOM, MAX_ZOOM))
+	if PREVIEW_FILE is not None:
+		save_preview(segments, PREVIEW_FILE, WIDTH)
@@ -5,6 +5,7 @@ import datetime
 import operator
 import geopy
 import geopy.distance
+import itertools
 import math
 
 
@@ -73,6 +74,449 @@ class Cluster:
 		return(np.arctan2(sum([np.sin(alpha/360*2*np.pi) for alpha in anglelist]),sum([np.cos(alpha/360*2*np.pi) for alpha in anglelist]))*180/np.pi)
 
 
+class DensityGrid:
+	"""
+	Coarse grid maintained incrementally alongside the cluster index, counting the points seen in each cell. Cells
+	denser than average get a larger clustering radius: more points means more GPS noise around the same roads, which a
+	fixed radius turns into extra clusters. The larger radius brings more candidate clusters per query, so only the
+	max_candidates nearest ones (among those with a compatible heading) are compared. Sparse and unseen cells keep the
+	global radius: a larger one would merge parallel roads and snap holes across empty areas.
+	"""
+	def __init__(self, cell_meter=200, max_factor=2.0, max_candidates=2):
+		self.cell_degree = cell_meter * 10e-6
+		self.max_factor = max_factor
+		self.max_candidates = max_candidates
+		self.cells = defaultdict(int)
+		self.total_points = 0
+
+	def _cell(self, lon, lat):
+		return (int(math.floor(lon / self.cell_degree)), int(math.floor(lat / self.cell_degree)))
+
+	def add(self, point):
+		self.cells[self._cell(point.lon, point.lat)] += 1
+		self.total_points += 1
+
+	def radius_factor(self, lon, lat):
+		"""
+		:return: factor to apply to the global radius in the cell of (lon, lat): the radius scales with sqrt(density)
+		relative to the mean density of the occupied cells, between 1 and max_factor.
+		"""
+		key = self._cell(lon, lat)
+		if key not in self.cells:
+			return 1.0
+		mean_count = float(self.total_points) / len(self.cells)
+		return min(self.max_factor, max(1.0, math.sqrt(self.cells[key] / mean_count)))
+
+	def nearest_candidates(self, lonlat, indices, clusters):
+		"""
+		:return: the max_candidates clusters of indices nearest to lonlat, in degrees as for the KD-tree, ties to the
+		lowest index
+		"""
+		x, y = lonlat
+		return sorted(indices, key=lambda c: ((clusters[c].lon - x) * (clusters[c].lon - x) +
+											  (clusters[c].lat - y) * (clusters[c].lat - y), c))[:self.max_candidates]
+
+	def snapshot(self, points):
+		"""
+		:return: state of the cells of the points, to be restored with restore after adding the points
+		"""
+		keys = set(self._cell(p.lon, p.lat) for p in points)
+		return self.total_points, dict((k, self.cells[k] if k in self.cells else None) for k in keys)
+
+	def restore(self, snapshot):
+		self.total_points, cells = snapshot
+		for k, v in cells.items():
+			if v is None:
+				self.cells.pop(k, None)
+			else:
+				self.cells[k] = v
+
+	def get_state(self):
+		"""
+		:return: dict of arrays describing the grid, to be checkpointed
+		"""
+		keys = list(self.cells.keys())
+		return {'grid_cells': np.array(keys, dtype=int).reshape(-1, 2),
+				'grid_counts': np.array([self.cells[k] for k in keys], dtype=int),
+				'grid_total': self.total_points}
+
+	def set_state(self, state):
+		for k, v in zip(state['grid_cells'].tolist(), state['grid_counts'].tolist()):
+			self.cells[tuple(k)] = v
+		self.total_points = int(state['grid_total'])
+
+
+def pack_trajectories(trajectories):
+	"""
+	Flatten trajectories into arrays, to be checkpointed.
+	:return: dict of arrays: point attributes and the offset of each trajectory
+	"""
+	points = [p for trajectory in trajectories for p in trajectory]
+	return {'offsets': np.cumsum([0] + [len(trajectory) for trajectory in trajectories]),
+			'vehicule_id': np.array([p.vehicule_id for p in points], dtype=int),
+			'lonlatspeedangle': np.array([(p.lon, p.lat, p.speed, p.angle) for p in points], dtype=float).reshape(-1, 4),
+			'timestamp': np.array([p.timestamp for p in points], dtype='datetime64[s]')}
+
+
+def unpack_trajectories(data):
+	"""
+	Inverse of pack_trajectories.
+	"""
+	points = []
+	for vid, (lon, lat, speed, angle), ts in zip(data['vehicule_id'].tolist(), data['lonlatspeedangle'].tolist(),
+												 data['timestamp'].astype(object)):
+		pt = GpsPoint(vehicule_id=vid, lon=lon, lat=lat, speed=speed, angle=angle)
+		pt.timestamp = ts
+		points.append(pt)
+	offsets = data['offsets'].tolist()
+	return [points[offsets[i]: offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def pack_clusters(clusters):
+	"""
+	Cluster attributes as arrays, to be checkpointed. The points of the clusters are not kept.
+	"""
+	return {'nb_points': np.array([c.nb_points for c in clusters], dtype=int),
+			'lonlatangle': np.array([(c.lon, c.lat, c.angle) for c in clusters], dtype=float).reshape(-1, 3),
+			'last_seen': np.array([c.last_seen for c in clusters], dtype='datetime64[s]')}
+
+
+def unpack_clusters(data):
+	"""
+	Inverse of pack_clusters.
+	"""
+	return [Cluster(cid=i, nb_points=nb, last_seen=ts, lat=lat, lon=lon, angle=angle) for i, (nb, (lon, lat, angle), ts)
+			in enumerate(zip(data['nb_points'].tolist(), data['lonlatangle'].tolist(), data['last_seen'].astype(object)))]
+
+
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+TIE_DISTANCE = 1e-3  # meters: approximate distances closer than this to a decision are recomputed with geopy.
+EXACT_LENGTH = 1000.0  # meters: approximate distances above this can be off by more than 0.01mm, and are recomputed with geopy.
+HOLE_CACHE_SIZE = 2 ** 18  # edges whose holes are kept by partition_edges.
+
+
+def meters_per_radian(lat):
+	"""
+	Radii of curvature of the WGS84 ellipsoid at latitude lat (degrees): meters per radian of latitude and of
+	longitude. Distances computed with them are within a micrometer of geopy over a few hundred meters, but the error
+	grows with the cube of the distance (2mm at 5km).
+	"""
+	w = 1 - WGS84_E2 * np.sin(np.radians(lat)) ** 2
+	return WGS84_A * (1 - WGS84_E2) / w ** 1.5, WGS84_A / np.sqrt(w) * np.cos(np.radians(lat))
+
+
+def approximate_distances(lonlat1, lonlat2):
+	"""
+	Distances in meters between two (n, 2) arrays of lon, lat, with the local radii of curvature.
+	"""
+	m_lat, m_lon = meters_per_radian((lonlat1[:, 1] + lonlat2[:, 1]) / 2)
+	return np.hypot(m_lon * np.radians(lonlat1[:, 0] - lonlat2[:, 0]), m_lat * np.radians(lonlat1[:, 1] - lonlat2[:, 1]))
+
+
+def candidate_clusters(lonlat, angles, kdtree, cluster_angles, radius, angle_tolerance, offset=0):
+	"""
+	Vectorized candidate search of a batch of points: the clusters of kdtree within radius (degrees) whose heading
+	differs by at most angle_tolerance.
+	:param lonlat: (n, 2) array of the points
+	:param angles: (n,) array of the headings of the points
+	:param kdtree: cKDTree of the clusters, None if there are none
+	:param cluster_angles: array of the headings of the clusters of kdtree
+	:param radius: float or (n,) array
+	:param angle_tolerance: float
+	:param offset: index of the first cluster of kdtree
+	:return: point index and cluster index of every candidate, ordered by point
+	"""
+	if kdtree is None or len(lonlat) == 0:
+		return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+	neighbors = kdtree.query_ball_point(lonlat, r=radius, p=2)
+	counts = np.array([len(nn) for nn in neighbors], dtype=int)
+	candidates = np.fromiter(itertools.chain.from_iterable(neighbors), dtype=int, count=counts.sum())
+	queries = np.repeat(np.arange(len(lonlat)), counts)
+	ok = np.abs(180 - np.abs(np.abs(angles[queries] - cluster_angles[candidates]) - 180)) <= angle_tolerance
+	return queries[ok], candidates[ok] + offset
+
+
+def nearest_candidates(queries, candidates, candidate_lonlat, lonlat, max_candidates):
+	"""
+	DensityGrid.nearest_candidates for a batch of candidates, as returned by candidate_clusters.
+	:return: queries, candidates and candidate_lonlat restricted to the max_candidates nearest candidates of each point
+	"""
+	d = candidate_lonlat - lonlat[queries]
+	order = np.lexsort((candidates, d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1], queries))
+	first = np.r_[True, queries[order][1:] != queries[order][:-1]]
+	rank = np.arange(len(order)) - np.flatnonzero(first)[np.cumsum(first) - 1]
+	keep = order[rank < max_candidates]
+	return queries[keep], candidates[keep], candidate_lonlat[keep]
+
+
+def closest_clusters(queries, candidates, candidate_lonlat, lonlat):
+	"""
+	Closest candidate cluster of each point, as chosen by the sequential loop: candidates within TIE_DISTANCE of the
+	closest one are compared with geopy.distance.distance, as are all the candidates of a point whose closest candidate
+	is further than EXACT_LENGTH, and exact ties go to the lowest cluster index.
+	:param queries: point index of every candidate, as returned by candidate_clusters
+	:param candidates: cluster index of every candidate
+	:param candidate_lonlat: (m, 2) array of the positions of the candidates
+	:param lonlat: (n, 2) array of the points
+	:return: index of the closest cluster or -1 for each point
+	"""
+	best = -np.ones(len(lonlat), dtype=int)
+	if len(queries) == 0:
+		return best
+	distances = approximate_distances(lonlat[queries], candidate_lonlat)
+	order = np.lexsort((candidates, distances, queries))
+	queries, candidates, distances, candidate_lonlat = queries[order], candidates[order], distances[order], candidate_lonlat[order]
+	first = np.r_[True, queries[1:] != queries[:-1]]
+	starts = np.flatnonzero(first)
+	best[queries[starts]] = candidates[starts]
+	group = np.cumsum(first) - 1
+	near = distances - distances[starts][group] <= TIE_DISTANCE
+	# candidates are sorted by distance within each point, so the near ones follow the closest one.
+	nb_near = np.bincount(group, near, len(starts)).astype(int)
+	far = distances[starts] > EXACT_LENGTH
+	ends = np.where(far, np.r_[starts[1:], len(queries)], starts + nb_near)
+	check = far | (nb_near > 1)
+	for s, e in zip(starts[check].tolist(), ends[check].tolist()):
+		x, y = lonlat[queries[s]].tolist()
+		pt = geopy.Point((y, x))
+		best[queries[s]] = min((geopy.distance.distance(pt, geopy.Point((cy, cx))).meters, c)
+							   for (cx, cy), c in zip(candidate_lonlat[s:e].tolist(), candidates[s:e].tolist()))[1]
+	return best
+
+
+def partition_edges(src, dst, distance_interval, cache=None):
+	"""
+	partition_edge for a batch of edges given by (n, 2) arrays of lon, lat. The number of holes of every edge is
+	derived from its approximate length, which is recomputed with geopy.distance.distance when it is within
+	TIE_DISTANCE of a multiple of distance_interval or longer than EXACT_LENGTH, and the holes are placed with the
+	Vincenty steps of partition_edge, so that they are the same as in the sequential loop.
+	:param cache: dict (source, target) -> holes, reused across calls: the edges between the same clusters come back
+	with every trajectory that follows the road. Cleared when it reaches HOLE_CACHE_SIZE edges.
+	:return: edge index, lon, lat and bearing of every hole, ordered by edge then along the edge
+	"""
+	if cache is None:
+		cache = {}
+	dist = approximate_distances(src, dst)
+	k = np.round(dist / distance_interval)
+	near = ((k >= 1) & (np.abs(dist - k * distance_interval) <= TIE_DISTANCE)) | (dist > EXACT_LENGTH)
+	nb = np.where(dist < distance_interval, 0, dist.astype(int) // distance_interval)
+	edges = np.flatnonzero(near | (nb > 0)).tolist()
+	near, nb = near.tolist(), nb.tolist()
+	src, dst = src.tolist(), dst.tolist()
+	d = geopy.distance.VincentyDistance(meters=distance_interval)
+	edge, lon, lat, bearing = [], [], [], []
+	for e in edges:
+		key = (tuple(src[e]), tuple(dst[e]))
+		holes = cache.get(key)
+		if holes is None:
+			startpoint = geopy.Point((src[e][1], src[e][0]))
+			endpoint = geopy.Point((dst[e][1], dst[e][0]))
+			n = nb[e]
+			if near[e]:
+				initial_dist = geopy.distance.distance(startpoint, endpoint).meters
+				n = 0 if initial_dist < distance_interval else int(initial_dist) // distance_interval
+			b = calculate_bearing(startpoint[0], startpoint[1], endpoint[0], endpoint[1])
+			holes = (b, [])
+			last_point = startpoint
+			for i in range(n):
+				last_point = geopy.Point(d.destination(point=last_point, bearing=b))
+				holes[1].append((last_point.longitude, last_point.latitude))
+			if len(cache) >= HOLE_CACHE_SIZE:
+				cache.clear()
+			cache[key] = holes
+		b, positions = holes
+		edge.extend([e] * len(positions))
+		bearing.extend([b] * len(positions))
+		lon.extend(x for x, y in positions)
+		lat.extend(y for x, y in positions)
+	return np.array(edge, dtype=int), np.array(lon, dtype=float), np.array(lat, dtype=float), np.array(bearing, dtype=float)
+
+
+def process_trajectory_block(block, clusters, roadnet, kdtree, radius_degree, sampling_distance, heading_tolerance,
+							 density_grid=None, hole_cache=None):
+	"""
+	Batched version of the Kharita* loop for a block of trajectories, with the same output: same clusters, created in
+	the same order, same edges. The cluster index only changes between trajectories, so the points of the whole block
+	are matched at once against kdtree, and each trajectory is completed against the clusters created by the
+	previous trajectories of the block. The holes of each trajectory are computed and matched at once, then a walk
+	over the trajectory creates the clusters and edges in the order of the sequential loop.
+	Distances are approximated with the local radii of curvature of the ellipsoid; the few decisions they cannot
+	settle (candidates or edge lengths within TIE_DISTANCE of each other or of a multiple of sampling_distance, and
+	distances above EXACT_LENGTH) use the geopy calls of the sequential loop.
+	:param block: list of trajectories
+	:param clusters: list of clusters, extended in place
+	:param roadnet: graph, extended in place
+	:param kdtree: cKDTree of the clusters, None if there are no clusters yet
+	:param density_grid: DensityGrid for adaptive radius, None to use the global parameters
+	:param hole_cache: dict kept across blocks by partition_edges, None to use one for this block only
+	:return: number of queries and number of candidate clusters compared
+	"""
+	nb_queries = 0
+	nb_candidates = 0
+	if kdtree is None:
+		# very first case: the first point creates a cluster and the index.
+		block = [trajectory for trajectory in block if len(trajectory) > 0]
+		if len(block) == 0:
+			return nb_queries, nb_candidates
+		point = block[0][0]
+		if density_grid is not None:
+			density_grid.add(point)
+		clusters.append(Cluster(cid=0, nb_points=1, last_seen=point.timestamp, lat=point.lat, lon=point.lon, angle=point.angle))
+		roadnet.add_node(0)
+		kdtree = cKDTree([c.get_lonlat() for c in clusters])
+		block = [block[0][1:]] + block[1:]
+		first_cluster = 0
+	else:
+		first_cluster = -1
+	if hole_cache is None:
+		hole_cache = {}
+	nb_old = len(clusters)
+	old_lonlat = np.array([c.get_lonlat() for c in clusters], dtype=float)
+	old_angles = np.array([c.angle for c in clusters], dtype=float)
+	# clusters created by the block, indexed from nb_old.
+	new_lonlat = []
+	new_angles = []
+	points = [p for trajectory in block for p in trajectory]
+	lonlat = np.array([p.get_lonlat() for p in points], dtype=float).reshape(-1, 2)
+	angles = np.array([p.angle for p in points], dtype=float)
+	radius = np.full(len(points), radius_degree)
+	if density_grid is not None:
+		# radius of each point once it has been added to the grid, as in the sequential loop. The grid is then
+		# rewound, and replayed trajectory by trajectory for the holes.
+		snapshot = density_grid.snapshot(points)
+		for k, p in enumerate(points):
+			density_grid.add(p)
+			radius[k] = radius_degree * density_grid.radius_factor(p.lon, p.lat)
+		density_grid.restore(snapshot)
+	queries, candidates = candidate_clusters(lonlat, angles, kdtree, old_angles, radius, heading_tolerance)
+	nb_queries += len(points)
+	bounds = np.searchsorted(queries, np.cumsum([0] + [len(trajectory) for trajectory in block]))
+
+	def cluster_positions(indices):
+		new = indices >= nb_old
+		positions = old_lonlat[np.where(new, 0, indices)]
+		if new.any():
+			positions[new] = np.array(new_lonlat, dtype=float)[indices[new] - nb_old]
+		return positions
+
+	local_tree = None
+	start = 0
+	for t, trajectory in enumerate(block):
+		sl = slice(start, start + len(trajectory))
+		start = sl.stop
+		if len(trajectory) == 0:
+			continue
+		if len(new_lonlat) > 0 and (local_tree is None or local_tree.n < len(new_lonlat)):
+			local_tree = cKDTree(new_lonlat)
+			local_angles = np.array(new_angles, dtype=float)
+		point_queries = queries[bounds[t]:bounds[t + 1]] - sl.start
+		point_candidates = candidates[bounds[t]:bounds[t + 1]]
+		if local_tree is not None:
+			# clusters created by the previous trajectories of the block.
+			local_queries, local_candidates = candidate_clusters(lonlat[sl], angles[sl], local_tree, local_angles, radius[sl],
+																 heading_tolerance, nb_old)
+			point_queries = np.concatenate([point_queries, local_queries])
+			point_candidates = np.concatenate([point_candidates, local_candidates])
+		point_lonlat = cluster_positions(point_candidates)
+		if density_grid is not None:
+			point_queries, point_candidates, point_lonlat = nearest_candidates(point_queries, point_candidates, point_lonlat,
+																			   lonlat[sl], density_grid.max_candidates)
+		nb_candidates += len(point_queries)
+		point_matches = closest_clusters(point_queries, point_candidates, point_lonlat, lonlat[sl])
+		# edges go from the cluster of each point to the cluster of the next one: the matched cluster, or a new cluster
+		# at the position of the point. Their holes are computed and matched at once.
+		position = np.where((point_matches >= 0)[:, None], cluster_positions(point_matches.clip(0)), lonlat[sl])
+		prev_position = np.vstack([cluster_positions(np.array([max(first_cluster, 0)])), position[:-1]])
+		steps = np.arange(0 if t == 0 and first_cluster >= 0 else 1, len(trajectory))
+		edge, hole_lon, hole_lat, hole_bearing = partition_edges(prev_position[steps], position[steps], sampling_distance,
+																 hole_cache)
+		hole_lonlat = np.column_stack([hole_lon, hole_lat])
+		hole_bounds = np.searchsorted(edge, np.arange(len(steps) + 1)).tolist()
+		hole_radius = radius_degree
+		if density_grid is not None:
+			# the holes of a point are matched once the point has been added to the grid.
+			hole_radius = np.full(len(edge), radius_degree)
+			s = 0
+			for k, point in enumerate(trajectory):
+				density_grid.add(point)
+				if s < len(steps) and steps[s] == k:
+					for h in range(hole_bounds[s], hole_bounds[s + 1]):
+						hole_radius[h] = radius_degree * density_grid.radius_factor(hole_lon[h], hole_lat[h])
+					s += 1
+		hole_queries, hole_candidates = candidate_clusters(hole_lonlat, hole_bearing, kdtree, old_angles, hole_radius,
+														   heading_tolerance)
+		nb_queries += len(edge)
+		if local_tree is not None:
+			local_queries, local_candidates = candidate_clusters(hole_lonlat, hole_bearing, local_tree, local_angles,
+																 hole_radius, heading_tolerance, nb_old)
+			hole_queries = np.concatenate([hole_queries, local_queries])
+			hole_candidates = np.concatenate([hole_candidates, local_candidates])
+		candidate_lonlat = cluster_positions(hole_candidates)
+		if density_grid is not None:
+			hole_queries, hole_candidates, candidate_lonlat = nearest_candidates(hole_queries, hole_candidates, candidate_lonlat,
+																				 hole_lonlat, density_grid.max_candidates)
+		nb_candidates += len(hole_queries)
+		hole_matches = closest_clusters(hole_queries, hole_candidates, candidate_lonlat, hole_lonlat).tolist()
+		hole_lon, hole_lat, hole_bearing = hole_lon.tolist(), hole_lat.tolist(), hole_bearing.tolist()
+		point_matches = point_matches.tolist()
+		# sequential walk: creates the clusters and the edges in the order of the loop.
+		new_nodes = []
+		edges = []
+		prev_cluster = first_cluster if t == 0 else -1
+		s = 0
+		for k, point in enumerate(trajectory):
+			if point_matches[k] >= 0:
+				current_cluster = point_matches[k]
+				clusters[current_cluster].add(point)
+			else:
+				current_cluster = len(clusters)
+				clusters.append(Cluster(cid=current_cluster, nb_points=1, last_seen=point.timestamp, lat=point.lat,
+										lon=point.lon, angle=point.angle))
+				new_lonlat.append((point.lon, point.lat))
+				new_angles.append(point.angle)
+				new_nodes.append(current_cluster)
+			if prev_cluster == -1:
+				prev_cluster = current_cluster
+				continue
+			prev_path_point = prev_cluster
+			h0, h1 = hole_bounds[s], hole_bounds[s + 1]
+			if h1 > h0:
+				# timestamp of the holes, as set by partition_edge.
+				diff_time = clusters[current_cluster].last_seen - clusters[prev_cluster].last_seen
+				hole_time = clusters[prev_cluster].last_seen + \
+							datetime.timedelta(seconds=(diff_time.days * 24 * 3600 + diff_time.seconds) // (h1 - h0))
+			for h in range(h0, h1):
+				if hole_matches[h] == -1:
+					new_cluster = Cluster(cid=len(clusters), nb_points=1, last_seen=point.timestamp, lat=hole_lat[h],
+										  lon=hole_lon[h], angle=hole_bearing[h])
+					clusters.append(new_cluster)
+					new_lonlat.append((hole_lon[h], hole_lat[h]))
+					new_angles.append(hole_bearing[h])
+					new_nodes.append(new_cluster.cid)
+					if math.fabs(diffangles(clusters[prev_path_point].angle, new_cluster.angle)) > heading_tolerance \
+						or math.fabs(diffangles(vector_direction_re_north(clusters[prev_path_point], new_cluster),
+												clusters[prev_path_point].angle)) > heading_tolerance:
+						prev_path_point = new_cluster.cid
+						continue
+					edges.append((prev_path_point, new_cluster.cid))
+					prev_path_point = new_cluster.cid
+				else:
+					edges.append((prev_path_point, hole_matches[h]))
+					prev_path_point = hole_matches[h]
+					hole = GpsPoint(lon=hole_lon[h], lat=hole_lat[h], angle=hole_bearing[h])
+					hole.timestamp = hole_time
+					clusters[prev_path_point].add(hole)
+			if h1 == h0 or hole_matches[h1 - 1] != current_cluster:
+				edges.append((prev_path_point, current_cluster))
+			prev_cluster = current_cluster
+			s += 1
+		roadnet.add_nodes_from(new_nodes)
+		roadnet.add_edges_from(edges)
+		first_cluster = -1
+	return nb_queries, nb_candidates
+
+
 def satisfy_path_condition_distance(s, t, g, clusters, alpha):
 	"""
 	return False if there's a path of length max length, True otherwise
@@ -135,9 +579,9 @@ def create_trajectories(INPUT_FILE_NAME='data/gps_data/gps_points_07-11.csv', wa
 		detections[p.vehicule_id].append(p)
 
 	# compute trajectories: split detections by waiting_threshold
-	print 'Computing trajectories'
+	print('Computing trajectories')
 	trajectories = []
-	for btd, ldetections in detections.iteritems():
+	for btd, ldetections in detections.items():
 		points = sorted(ldetections, key=operator.attrgetter('timestamp'))
 		source = 0
 		prev_point = 0
@@ -187,8 +631,8 @@ def partition_edge(edge, distance_interval):
 	last_point = startpoint
 	diff_time = edge[1].last_seen - edge[0].last_seen
 	delta_time = diff_time.days*24*3600 + diff_time.seconds
-	time_increment = delta_time / (int(initial_dist) / distance_interval)
-	for i in range(int(initial_dist) / distance_interval):
+	time_increment = delta_time // (int(initial_dist) // distance_interval)
+	for i in range(int(initial_dist) // distance_interval):
 		new_point = geopy.Point(d.destination(point=last_point, bearing=bearing))
 		str_timestamp = datetime.datetime.strftime(edge[0].last_seen + datetime.timedelta(seconds=time_increment), "%Y-%m-%d %H:%M:%S+03")
 		holes.append(GpsPoint(lat=new_point.latitude, lon=new_point.longitude, angle=bearing,
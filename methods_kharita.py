@@ -6,7 +6,9 @@ import sys
 import matplotlib.pyplot as plt
 from geopy.distance import vincenty
 from sklearn.neighbors import NearestNeighbors
+from scipy.spatial import cKDTree
 from geojson import MultiLineString
+from checkpoint import Checkpoint, pack_seeds, unpack_seeds
 
 LL = (41, -87);
 latconst = vincenty(LL, (LL[0] + 1, LL[1])).meters;
@@ -24,30 +26,64 @@ def angledist(a1, a2):
     return(min(abs(a1-a2),abs((a1-a2) % 360),abs((a2-a1) % 360),abs(a2-a1)))
 
 
-def getdata(nsamples,datafile,datestart,datestr):
-#3233678911,1080020,83,2015-10-03 06:52:48,57,51.4950963,25.262793500000001,PICKUP,private,100
-    datapointwts = [];
-    lats = []; lons = []; j = 0;
-    with open(datafile,'rb') as f:
-        for line in f:
-            j = j+1;
-            if j>nsamples:
-                break;
-            line = line[:-1].decode('ascii', 'ignore')
-            zz = line.split("\t")
-            if zz[6][:10]<datestr and zz[6][:10]>=datestart:#(LL[0] < 51.48) and LL[1] > 25.29:
-                ts = time.mktime(datetime.datetime.strptime(zz[6][:-3], "%Y-%m-%d %H:%M:%S").timetuple())
-                LL = (float(zz[0][:8]),float(zz[1][:8])); angle = float(zz[-1])-180; speed = float(zz[5])
-                if j>1:
-                    if oldts<ts and oldts>ts-20:
-                        speed = int(geodist(LL,oldLL)/(ts-oldts)*3.6)
-                lats.append(LL[0])
-                lons.append(LL[1])
-                pointwts = (LL[0],LL[1],angle,speed,j,ts);
-#                print(pointwts)
-                oldLL = LL; oldts = ts;
-                datapointwts.append(pointwts)
-    return(datapointwts)
+def readcolumns(datafile, nsamples, chunksize, vehiclecol):
+    # parse the file block by block into arrays: lon, lat, speed, angle, line number, timestamp (datetime64) and
+    # vehicle id. Numeric fields are converted by numpy, only the tab split is done per line.
+    cols = {'lon': [], 'lat': [], 'speed': [], 'angle': [], 'j': [], 'time': [], 'vehicle': []}
+    j = 0
+    with open(datafile, 'rb') as f:
+        while j < nsamples:
+            lines = f.readlines(chunksize)
+            if len(lines) == 0:
+                break
+            lines = lines[:nsamples - j]
+            zz = [line.rstrip(b'\r\n').split(b'\t') for line in lines]
+            cols['lon'].append(np.array([xx[0] for xx in zz], dtype='S8').astype(float))
+            cols['lat'].append(np.array([xx[1] for xx in zz], dtype='S8').astype(float))
+            cols['speed'].append(np.array([xx[5] for xx in zz]).astype(float))
+            cols['angle'].append(np.array([xx[-1] for xx in zz]).astype(float) - 180)
+            cols['time'].append(np.array([xx[6] for xx in zz], dtype='S19').astype('datetime64[s]'))
+            if vehiclecol is not None:
+                cols['vehicle'].append(np.array([xx[vehiclecol] for xx in zz]))
+            cols['j'].append(np.arange(j + 1, j + len(zz) + 1))
+            j = j + len(zz)
+    # empty input: empty columns of the same types, so that the date filter still applies
+    empty = {'time': np.zeros(0, dtype='datetime64[s]'), 'j': np.zeros(0, dtype=int), 'vehicle': np.zeros(0, dtype='S1')}
+    return {cc: np.concatenate(cols[cc]) if len(cols[cc]) > 0 else empty.get(cc, np.zeros(0)) for cc in cols}
+
+def localtimestamps(times):
+    # same values as time.mktime(...timetuple()) (local time), with mktime called once per distinct hour
+    hours = times.astype('datetime64[h]')
+    uhours, inverse = np.unique(hours, return_inverse=True)
+    base = np.array([time.mktime(hh.astype(datetime.datetime).timetuple()) for hh in uhours])
+    return base[inverse.reshape(-1)] + (times - hours).astype(float)
+
+def getdata(nsamples,datafile,datestart,datestr,minspeed=None,vehiclecol=None,chunksize=2**24):
+    # points (lon, lat, angle, speed, line number, timestamp) recorded in [datestart, datestr) among the first
+    # nsamples lines of the tab separated datafile. The speed is recomputed from the previous point when it was
+    # recorded less than 20 seconds before: the previous point of the file, or of the same vehicle when vehiclecol
+    # (index of the vehicle id column) is given. minspeed drops the slower points once speeds are derived.
+    cols = readcolumns(datafile, nsamples, chunksize, vehiclecol)
+    days = cols['time'].astype('datetime64[D]')
+    mask = (days >= np.datetime64(datestart)) & (days < np.datetime64(datestr))
+    cols = {cc: cols[cc][mask] if len(cols[cc]) == len(mask) else cols[cc] for cc in cols}
+    ts = localtimestamps(cols['time'])
+    lon, lat, speed = cols['lon'], cols['lat'], cols['speed']
+    if vehiclecol is None:
+        order = np.arange(len(ts))
+    else:
+        order = np.lexsort((cols['j'], ts, cols['vehicle']))
+    if len(order) > 1:
+        prev, cur = order[:-1], order[1:]
+        dt = ts[cur] - ts[prev]
+        ok = (dt > 0) & (dt < 20)
+        if vehiclecol is not None:
+            ok &= cols['vehicle'][cur] == cols['vehicle'][prev]
+        prev, cur = prev[ok], cur[ok]
+        speed[cur] = np.trunc(geodist((lon[cur], lat[cur]), (lon[prev], lat[prev])) / dt[ok] * 3.6)
+    keep = np.ones(len(ts), dtype=bool) if minspeed is None else speed >= minspeed
+    return list(zip(lon[keep].tolist(), lat[keep].tolist(), cols['angle'][keep].tolist(), speed[keep].tolist(),
+                    cols['j'][keep].tolist(), ts[keep].tolist()))
 
 def greaterthanangle(alpha,beta):
     if (beta-alpha)%360<180:
@@ -147,9 +183,10 @@ def getpossibleedges(datapointwts,seeds):
                 gedges1[(cd1,cd2)] =  gedges1.get((cd1,cd2),0)+1;
     return(gedges1)
 
-def coocurematrix(datapointwts,seeds,theta):
+def coocurematrix(datapointwts,seeds,theta,p2cluster=None):
     startcoocurence = time.time();    gedges1 = {}; std = {};
-    cluster, p2cluster = point2cluster(datapointwts, seeds,theta);
+    if p2cluster is None:
+        cluster, p2cluster = point2cluster(datapointwts, seeds,theta);
     for ii, xx in enumerate(datapointwts):
         if ii>1:
             if datapointwts[ii-1][-1]<=datapointwts[ii][-1] and datapointwts[ii-1][-1]>=datapointwts[ii][-1]-121 and taxidist(datapointwts[ii-1],datapointwts[ii],theta)<1000:
@@ -216,95 +253,152 @@ def prunegraph(gedges,seeds):
           del gedges[gg];
     return (gedges)
 
+def pointlabels(datapointwts,seeds,theta):
+    # nearest seed of every point in the (lonconst*lon, latconst*lat, theta/180*angle) space, with the headings taken
+    # as given and modulo 360: the closer of the two (the modulo one on ties)
+    X = np.array([xx[:3] for xx in datapointwts], dtype=float).reshape(-1, 3)
+    S = np.array([xx[:3] for xx in seeds], dtype=float).reshape(-1, 3)
+    scale = np.array([lonconst, latconst, theta / 180])
+    Xrot = X.copy(); Xrot[:, 2] %= 360
+    Srot = S.copy(); Srot[:, 2] %= 360
+    distances, indices = cKDTree(S * scale).query(X * scale)
+    distancesrot, indicesrot = cKDTree(Srot * scale).query(Xrot * scale)
+    return np.where(distances < distancesrot, indices, indicesrot)
+
 def point2cluster(datapointwts,seeds,theta):
-    cluster = {};p2cluster = []; gedges = {}; gedges1 = {}; nedges = {}; std = {}; seeds1 = []; seedweight = [];
-    X = [(lonconst * xx[0], latconst * xx[1], theta / 180 * xx[2]) for xx in datapointwts];    S = [(lonconst * xx[0], latconst * xx[1], theta / 180 * xx[2]) for xx in seeds];
-    Xrot = [(lonconst * xx[0], latconst * xx[1], theta / 180 * (xx[2]%360)) for xx in datapointwts];    Srot = [(lonconst * xx[0], latconst * xx[1], theta / 180 * (xx[2]%360)) for xx in seeds];
-    for cd in range(len(seeds)):
-        cluster[cd] = []
-    nbrs = NearestNeighbors(n_neighbors=1, algorithm='ball_tree').fit(S)
-    distances, indices = nbrs.kneighbors(X)
-    nbrsrot = NearestNeighbors(n_neighbors=1, algorithm='ball_tree').fit(Srot)
-    distancesrot, indicesrot = nbrsrot.kneighbors(Xrot)
-    for ii, ll in enumerate(indices):
-        #        print(distances[ii],distancesrot[ii],ll,indices[ii],indicesrot[ii])
-        cd = indicesrot[ii][0]
-        if distances[ii][0] < distancesrot[ii][0]:
-            cd = indices[ii][0];
-            #        print(cd,distances[ii],distancesrot[ii],ll,indices[ii],indicesrot[ii])
+    cluster = {cd: [] for cd in range(len(seeds))}
+    p2cluster = pointlabels(datapointwts, seeds, theta).tolist()
+    for ii, cd in enumerate(p2cluster):
         cluster[cd].append(datapointwts[ii])
-        p2cluster.append(cd)
     return(cluster,p2cluster)
 
+def groupedpercentile(values, labels, nlabels, q):
+    # np.percentile (linear interpolation) of values within each label, computed with one sort for all labels
+    order = np.lexsort((values, labels))
+    values = values[order]
+    counts = np.bincount(labels, minlength=nlabels)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    pos = (counts - 1).clip(0) * q / 100.0
+    lower = np.floor(pos).astype(int)
+    upper = np.minimum(lower + 1, (counts - 1).clip(0))
+    result = np.zeros(nlabels)
+    nz = counts > 0
+    lo = values[(starts + lower)[nz]]; hi = values[(starts + upper)[nz]]
+    result[nz] = lo + (hi - lo) * (pos - lower)[nz]
+    return result
+
+def headingstats(datapointwts, seeds, theta):
+    # per point cluster labels, and per cluster size, 90th percentile heading deviation from the seed heading and
+    # clockwise mask of the points (same definitions as angledist and greaterthanangle)
+    labels = pointlabels(datapointwts, seeds, theta)
+    angles = np.array([xx[2] for xx in datapointwts], dtype=float)
+    mang = np.array([ss[-1] for ss in seeds], dtype=float)[labels]
+    diff = angles - mang
+    deviation = np.minimum(np.abs(diff), np.minimum(diff % 360, (-diff) % 360))
+    clockwise = (mang - angles) % 360 < 180
+    counts = np.bincount(labels, minlength=len(seeds))
+    return labels, counts, groupedpercentile(deviation, labels, len(seeds), 90), clockwise
+
+def groupedavgpoint(datapointwts, groups, ngroups):
+    # avgpoint of every group of points at once
+    X = np.array([xx[:3] for xx in datapointwts], dtype=float).reshape(-1, 3)
+    counts = np.bincount(groups, minlength=ngroups).clip(1)
+    rad = X[:, 2] / 360 * 2 * np.pi
+    hh = np.arctan2(np.bincount(groups, np.sin(rad), ngroups), np.bincount(groups, np.cos(rad), ngroups)) * 180 / np.pi
+    return np.bincount(groups, X[:, 0], ngroups) / counts, np.bincount(groups, X[:, 1], ngroups) / counts, hh
+
 def splitclusters(datapointwts,seeds,theta):
-    std = {}; seeds1 = []; seedweight = [];
-    cluster, p2cluster = point2cluster(datapointwts, seeds,theta);
-    for cl in cluster:
-        mang = seeds[cl][-1];
-        if len(cluster[cl]) > 10:
-            std[cl] = np.percentile([angledist(xx[2], mang) for xx in cluster[cl]], 90)
-            clockwise = [xx for xx in cluster[cl] if greaterthanangle(xx[2], mang)];
-            if std[cl]>20 and len(clockwise)>0 and len(clockwise)<len(cluster[cl]):
-                seeds1.append(avgpoint(clockwise))
-                seeds1.append(avgpoint([xx for xx in cluster[cl] if not greaterthanangle(xx[2], mang)]))
-                seedweight.append(len(clockwise))
-                seedweight.append(len(cluster[cl]) -len(clockwise))
-            else:
-                seeds1.append(seeds[cl]); seedweight.append(len(cluster[cl]))
+    labels, counts, std, clockwise = headingstats(datapointwts, seeds, theta)
+    ncw = np.bincount(labels, clockwise, len(seeds)).astype(int)
+    split = (counts > 10) & (std > 20) & (ncw > 0) & (ncw < counts)
+    # groups 2*cl and 2*cl+1 are the clockwise and counter-clockwise halves of cluster cl
+    lon, lat, hh = groupedavgpoint(datapointwts, 2 * labels + (~clockwise), 2 * len(seeds))
+    seeds1 = []; seedweight = [];
+    for cl in range(len(seeds)):
+        if split[cl]:
+            seeds1.append((lon[2 * cl], lat[2 * cl], hh[2 * cl]))
+            seeds1.append((lon[2 * cl + 1], lat[2 * cl + 1], hh[2 * cl + 1]))
+            seedweight.append(int(ncw[cl]))
+            seedweight.append(int(counts[cl] - ncw[cl]))
         else:
-            seeds1.append(seeds[cl]); seedweight.append(len(cluster[cl]))
+            seeds1.append(seeds[cl]); seedweight.append(int(counts[cl]))
     return seeds1, seedweight
 
-def splitclustersparallel(datapointwts,seeds):
-    X = [(xx[0], xx[1]) for xx in datapointwts];    S = [(xx[0], xx[1]) for xx in seeds];cluster = {};p2cluster = []; gedges = {}; gedges1 = {}; nedges = {}; std = {}; seeds1 = []; seedweight = []; roadwidth = [];
-    nbrs = NearestNeighbors(n_neighbors=20, algorithm='ball_tree').fit(S)
-    distances, indices = nbrs.kneighbors(X)
-    for cd in range(len(seeds)):
-        cluster[cd] = []; roadwidth.append(0);
-    for ii, ll in enumerate(indices):
-        dd = [taxidist(seeds[xx], datapointwts[ii][:-1],theta) for xx in ll]
-        cd = ll[dd.index(min(dd))];
-        cluster[cd].append(datapointwts[ii])
-        p2cluster.append(cd)
-    for cl in cluster:
-        mang = seeds[cl][-1];
-        scl = seeds[cl]
-        if len(cluster[cl]) > 10:
-            std[cl] = np.percentile([angledist(xx[2], mang) for xx in cluster[cl]], 90)
-            roadwidth[cl] = 1+5*np.std([geodist(scl,xx)*np.sin(anglebetweentwopoints(scl,xx)-scl[-1])  for xx in cluster[cl]])
-            print(cl,scl,[(anglebetweentwopoints(scl,xx),scl[-1])  for xx in cluster[cl]])
+def splitclustersparallel(datapointwts,seeds,theta,p2cluster=None):
+    # road width estimate of every cluster of more than 10 points, from the spread of the points orthogonally
+    # to the seed heading: 1+5*std of the lateral offsets in meters. 0 for the other clusters.
+    labels = pointlabels(datapointwts, seeds, theta) if p2cluster is None else np.asarray(p2cluster, dtype=int)
+    counts = np.bincount(labels, minlength=len(seeds))
+    X = np.array([xx[:2] for xx in datapointwts], dtype=float).reshape(-1, 2)
+    S = np.array([ss[:3] for ss in seeds], dtype=float)[labels]
+    dx = lonconst * (X[:, 0] - S[:, 0]); dy = latconst * (X[:, 1] - S[:, 1]);
+    lateral = dx * np.cos(S[:, 2] / 180 * np.pi) - dy * np.sin(S[:, 2] / 180 * np.pi)
+    n = counts.clip(1)
+    mean = np.bincount(labels, lateral, len(seeds)) / n
+    var = (np.bincount(labels, lateral ** 2, len(seeds)) / n - mean ** 2).clip(0)
+    roadwidth = np.where(counts > 10, 1 + 5 * np.sqrt(var), 0)
+    return list(roadwidth)
 
 def printclusters(seeds):
     fdist = open('clusters_uic.txt', 'w')
     for pp in seeds:
         print(pp[0],pp[1],pp[2],end = '\n', file = fdist)
 
-def computeclusters(datapointwts,maxiteration,SEEDRADIUS,theta):
-    datapoint = [(x[0], x[1], x[2]) for x in datapointwts];
-    seeds = getseeds(datapoint, SEEDRADIUS,theta);
+def computeclusters(datapointwts,maxiteration,SEEDRADIUS,theta,checkpoint=None):
+    # checkpoint: Checkpoint of the clustering; the seeds and every newmeans iteration are saved in its sub-stages
+    checkpoint = checkpoint or Checkpoint(None, '')
+    seedsckpt = checkpoint.stage('seeds'); meansckpt = checkpoint.stage('means');
+    state = meansckpt.load(); start = 0; converged = False;
     oldcost = 100000000;
-    for ss in range(maxiteration):
+    if state is not None:
+        seeds = unpack_seeds(state['seeds']); start = int(state['iteration']); oldcost = float(state['cost']); converged = bool(state['converged']);
+    else:
+        state = seedsckpt.load()
+        if state is not None:
+            seeds = unpack_seeds(state['seeds'])
+        else:
+            datapoint = [(x[0], x[1], x[2]) for x in datapointwts];
+            seeds = getseeds(datapoint, SEEDRADIUS,theta);
+            if seedsckpt.enabled():
+                seedsckpt.save(seeds=pack_seeds(seeds))
+    for ss in range(start, maxiteration):
+        if converged:
+            break;
         nseeds,cost,avgspeed,pointsperseed = newmeans(datapointwts,seeds,theta)
         print(ss, cost)
         if (oldcost-cost)/cost<0.0001:
-            break;
-        seeds = nseeds;
-        oldcost = cost;
+            converged = True
+        else:
+            seeds = nseeds;
+            oldcost = cost;
+        if meansckpt.enabled():
+            meansckpt.save(seeds=pack_seeds(seeds), iteration=ss + 1, cost=oldcost, converged=converged)
     for ii in range(1):
         seeds, seedweight = splitclusters(datapointwts, seeds,theta);
     return(seeds)
 
-def printedges(gedges, seeds,datapointwts,theta):
+def printedges(gedges, seeds,datapointwts,theta,p2cluster=None):
     fdist = open('edgesuic.txt', 'w')
     maxspeed = [0 for xx in range(len(seeds))]
-    cluster, p2cluster = point2cluster(datapointwts, seeds,theta);
+    if p2cluster is None:
+        cluster, p2cluster = point2cluster(datapointwts, seeds,theta);
+    else:
+        cluster = {cd: [] for cd in range(len(seeds))}
+        for ii, cd in enumerate(p2cluster):
+            cluster[cd].append(datapointwts[ii])
     for cd in cluster:
         maxspeed[cd] = int(np.percentile([0] + [xx[3] for xx in cluster[cd]], 90))
     for gg in gedges:
         print(seeds[gg[0]][0],seeds[gg[0]][1],seeds[gg[0]][2],seeds[gg[1]][0],seeds[gg[1]][1],seeds[gg[1]][2], maxspeed[gg[0]], maxspeed[gg[1]], end = '\n', file = fdist)
 
-def getgeojson(gedges,seeds):
-    fdist = open('map0.geojson', 'w')
+def printroadwidth(seeds, roadwidth):
+    # road width of every cluster, alongside the edges: lon lat angle width
+    fdist = open('roadwidthuic.txt', 'w')
+    for pp, ww in zip(seeds, roadwidth):
+        print(pp[0],pp[1],pp[2],round(ww, 1),end = '\n', file = fdist)
+
+def getgeojson(gedges,seeds,fname='map0.geojson'):
+    fdist = open(fname, 'w')
     inp = []
     for xx in gedges:
         ll1 = seeds[xx[0]]; ll2 = seeds[xx[1]];
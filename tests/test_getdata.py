@@ -0,0 +1,53 @@
+import math
+
+from methods_kharita import geodist, getdata
+
+
+def test_getdata_empty(tmpdir):
+	datafile = tmpdir.join('empty.tsv')
+	datafile.write('')
+	assert getdata(100, str(datafile), '2010-10-01', '2015-10-08') == []
+	assert getdata(100, str(datafile), '2010-10-01', '2015-10-08', minspeed=10, vehiclecol=2) == []
+
+
+def test_getdata_filters_dates(tmpdir):
+	datafile = tmpdir.join('points.tsv')
+	datafile.write('-87.6601321\t41.8706404\t3\tx\ty\t30.0\t2015-10-02 15:33:27+03\t292.78\n'
+				   '-87.6586960\t41.8709470\t4\tx\ty\t27.2\t2015-11-02 15:33:23+03\t336.63\n')
+	points = getdata(100, str(datafile), '2010-10-01', '2015-10-08')
+	assert len(points) == 1
+	# lon and lat keep their first 8 characters, as in the original parser.
+	assert points[0][:4] == (-87.6601, 41.87064, 292.78 - 180, 30.0)
+
+
+def line(lon, lat, vehicle, speed, timestamp):
+	return '%s\t%s\t%s\tx\ty\t%s\t%s+03\t90.0\n' % (lon, lat, vehicle, speed, timestamp)
+
+
+def test_getdata_speed_window(tmpdir):
+	datafile = tmpdir.join('points.tsv')
+	datafile.write(line('-87.6600', '41.8700', 1, 5.0, '2015-10-02 15:00:00') +
+				   line('-87.6600', '41.8710', 1, 5.0, '2015-10-02 15:00:10') +  # 10s after: recomputed
+				   line('-87.6600', '41.8720', 1, 5.0, '2015-10-02 15:00:30') +  # 20s after: kept
+				   line('-87.6600', '41.8730', 1, 5.0, '2015-10-02 15:00:30'))   # same second: kept
+	speeds = [p[3] for p in getdata(100, str(datafile), '2010-10-01', '2015-10-08')]
+	meters = geodist((-87.66, 41.871), (-87.66, 41.87))
+	assert meters / 10 * 3.6 % 1 > 0.5  # truncated, not rounded
+	assert speeds == [5.0, math.trunc(meters / 10 * 3.6), 5.0, 5.0]
+
+
+def test_getdata_per_vehicle(tmpdir):
+	# two vehicles interleaved in the file, vehicle 1 out of time order.
+	datafile = tmpdir.join('points.tsv')
+	datafile.write(line('-87.6600', '41.8710', 1, 5.0, '2015-10-02 15:00:10') +
+				   line('-87.6500', '41.8700', 2, 5.0, '2015-10-02 15:00:00') +
+				   line('-87.6600', '41.8700', 1, 5.0, '2015-10-02 15:00:00') +
+				   line('-87.6500', '41.8705', 2, 5.0, '2015-10-02 15:00:05'))
+	by_line = [p[3] for p in getdata(100, str(datafile), '2010-10-01', '2015-10-08')]
+	by_vehicle = [p[3] for p in getdata(100, str(datafile), '2010-10-01', '2015-10-08', vehiclecol=2)]
+	# the previous line is the previous point, whatever the vehicle and the time.
+	assert by_line == [5.0, 5.0, 5.0, math.trunc(geodist((-87.65, 41.8705), (-87.66, 41.87)) / 5 * 3.6)]
+	assert by_vehicle == [math.trunc(geodist((-87.66, 41.871), (-87.66, 41.87)) / 10 * 3.6), 5.0, 5.0,
+						  math.trunc(geodist((-87.65, 41.8705), (-87.65, 41.87)) / 5 * 3.6)]
+	# minspeed applies to the derived speeds.
+	assert len(getdata(100, str(datafile), '2010-10-01', '2015-10-08', minspeed=10, vehiclecol=2)) == 2
@@ -0,0 +1,144 @@
+import datetime
+import math
+import os
+import random
+import subprocess
+import sys
+
+import geopy
+import geopy.distance
+import numpy as np
+import pytest
+
+from methods import Cluster, DensityGrid, GpsPoint, create_trajectories, partition_edge, partition_edges
+
+KHARITA_STAR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kharita_star.py')
+
+
+def write_city(fname, nb_routes=20, seed=0, pause=0.2):
+	"""
+	Vehicles driving random routes on a grid of streets 150m apart, one noisy point every 3 seconds. Before each
+	point, a vehicle stops for 30 seconds with probability pause, which splits its trajectory (waiting threshold of
+	21 seconds) and leaves one-point and empty trajectories.
+	"""
+	rnd = random.Random(seed)
+	meters_per_degree = 111320.0
+	t = datetime.datetime(2015, 10, 1)
+	rows = []
+	for vehicule_id in range(nb_routes):
+		i, j = rnd.randrange(6), rnd.randrange(6)
+		path = [(i * 150.0, j * 150.0)]
+		for _ in range(rnd.randrange(3, 7)):
+			if rnd.random() < 0.5:
+				i = min(5, max(0, i + rnd.choice((-1, 1))))
+			else:
+				j = min(5, max(0, j + rnd.choice((-1, 1))))
+			if (i * 150.0, j * 150.0) != path[-1]:
+				path.append((i * 150.0, j * 150.0))
+		ts = t
+		for (x1, y1), (x2, y2) in zip(path[:-1], path[1:]):
+			length = math.hypot(x2 - x1, y2 - y1)
+			angle = math.degrees(math.atan2(x2 - x1, y2 - y1)) % 360
+			pos = rnd.uniform(0, 30)
+			while pos < length:
+				x = x1 + (x2 - x1) * pos / length + rnd.gauss(0, 3)
+				y = y1 + (y2 - y1) * pos / length + rnd.gauss(0, 3)
+				lon = -87.65 + x / (meters_per_degree * math.cos(math.radians(41.87)))
+				lat = 41.87 + y / meters_per_degree
+				rows.append((ts, vehicule_id, lat, lon, (angle + rnd.gauss(0, 5)) % 360))
+				ts += datetime.timedelta(seconds=30 if rnd.random() < pause else 3)
+				pos += 30 * rnd.uniform(0.8, 1.2)
+		t += datetime.timedelta(seconds=7)
+	rows.sort()
+	with open(fname, 'w') as f:
+		f.write('vehicule_id,timestamp,lat,lon,speed,angle\n')
+		for ts, vehicule_id, lat, lon, angle in rows:
+			f.write('%s,%s+03,%.7f,%.7f,30,%.1f\n' % (vehicule_id, ts.strftime('%Y-%m-%d %H:%M:%S'), lat, lon, angle))
+
+
+def run_kharita_star(path, *options):
+	with open(os.devnull, 'w') as devnull:
+		subprocess.check_call([sys.executable, KHARITA_STAR, '-p', path, '-f', 'city', '-r', '25', '-s', '20', '-a', '40']
+							  + list(options), cwd=path, stdout=devnull)
+	with open(os.path.join(path, 'city_edges.txt')) as f:
+		return f.read()
+
+
+@pytest.mark.parametrize('adaptive', [[], ['-A']])
+def test_batched_same_map(tmpdir, adaptive):
+	write_city(str(tmpdir.join('city.csv')))
+	lengths = [len(trajectory) for trajectory in create_trajectories(str(tmpdir.join('city.csv')), waiting_threshold=21)]
+	assert 0 in lengths and 1 in lengths
+	sequential = run_kharita_star(str(tmpdir), *adaptive)
+	assert len(sequential) > 0
+	for batch_size in ['1', '7']:
+		assert run_kharita_star(str(tmpdir), '-b', batch_size, *adaptive) == sequential
+
+
+# runs kharita_star.py and kills it (no cleanup, as a crash would) when it starts processing trajectory CRASH_AT.
+CRASH = """
+import os, runpy, sys
+class Crash(object):
+	def __init__(self, stream):
+		self.stream = stream
+	def write(self, text):
+		if text.startswith('\\rprocessing trajectory: ') and int(text.split()[2]) >= %d:
+			os._exit(1)
+		self.stream.write(text)
+	def flush(self):
+		self.stream.flush()
+sys.stdout = Crash(sys.stdout)
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+CRASH_AT = 12
+
+
+@pytest.mark.parametrize('mode', [[], ['-A'], ['-b', '7']])
+def test_checkpoint_resume(tmpdir, mode):
+	write_city(str(tmpdir.join('city.csv')))
+	fresh = run_kharita_star(str(tmpdir), *mode)
+	checkpoint = ['-c', str(tmpdir.join('checkpoints')), '-P', '5']
+	with open(os.devnull, 'w') as devnull:
+		assert subprocess.call([sys.executable, '-c', CRASH % CRASH_AT, KHARITA_STAR, '-p', str(tmpdir), '-f', 'city',
+								'-r', '25', '-s', '20', '-a', '40'] + checkpoint + mode, cwd=str(tmpdir), stdout=devnull) == 1
+	saved = tmpdir.join('checkpoints').listdir('map-*.npz')
+	assert len(saved) == 1
+	with np.load(str(saved[0])) as state:
+		assert 0 < int(state['next_trajectory']) < CRASH_AT
+	assert run_kharita_star(str(tmpdir), *(checkpoint + mode)) == fresh
+
+
+@pytest.mark.parametrize('lat', [41.87, 75.0])
+def test_partition_edges_long_edges(lat):
+	# GPS jumps of about 20km, a few centimeters around a multiple of the sampling distance: the approximate distance
+	# is off by more than that, and the number of holes must still be the one of partition_edge.
+	start = Cluster(cid=0, nb_points=1, last_seen=datetime.datetime(2015, 10, 1), lat=lat, lon=-87.65, angle=0)
+	targets = []
+	for bearing in (0, 45, 90):
+		for length in (20000 - 0.05, 20000 + 0.05):
+			p = geopy.distance.distance(meters=length).destination(geopy.Point(lat, -87.65), bearing)
+			targets.append(Cluster(cid=1, nb_points=1, last_seen=datetime.datetime(2015, 10, 1, 0, 10), lat=p.latitude,
+								   lon=p.longitude, angle=bearing))
+	edge, hole_lon, hole_lat, hole_bearing = partition_edges(np.array([start.get_lonlat()] * len(targets)),
+															 np.array([t.get_lonlat() for t in targets]), 20)
+	for e, target in enumerate(targets):
+		holes = partition_edge((start, target), 20)
+		assert np.sum(edge == e) == len(holes)
+		assert hole_lon[edge == e].tolist() == [h.lon for h in holes]
+		assert hole_lat[edge == e].tolist() == [h.lat for h in holes]
+
+
+def test_density_grid():
+	grid = DensityGrid(cell_meter=200, max_factor=2.0, max_candidates=2)
+	# a dense cell of 99 points and a sparse one of 1 point: mean of 50 points per cell.
+	for k in range(99):
+		grid.add(GpsPoint(lon=-87.65, lat=41.87, angle=0))
+	grid.add(GpsPoint(lon=-87.6, lat=41.87, angle=0))
+	assert grid.radius_factor(-87.65, 41.87) == pytest.approx(math.sqrt(99 / 50.0))
+	assert grid.radius_factor(-87.6, 41.87) == 1.0
+	assert grid.radius_factor(-87.5, 41.87) == 1.0
+	clusters = [Cluster(cid=i, nb_points=1, last_seen=None, lat=41.87, lon=-87.65 + d, angle=0)
+				for i, d in enumerate([3e-5, 1e-5, -2e-5, 1e-5])]
+	assert grid.nearest_candidates((-87.65, 41.87), [0, 1, 2, 3], clusters) == [1, 3]
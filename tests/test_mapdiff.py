@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from mapdiff import METERS_PER_DEGREE, NODE_ID_PRECISION, apply_delta, diff_maps, index_edges, read_map, write_map
+
+LON0, LAT0 = -87.65, 41.87
+STEP = 20.0  # meters between the nodes of a road
+
+
+def road(row, nb_nodes=10, shift=0.0, angle=90.0):
+	"""
+	Edges of an east bound road, row * 100 meters north of the origin, moved north by shift meters.
+	"""
+	lat = LAT0 + (row * 100.0 + shift) / METERS_PER_DEGREE
+	dlon = STEP / (METERS_PER_DEGREE * 0.7460)
+	nodes = [(round(LON0 + i * dlon, 7), round(lat, 7), angle) for i in range(nb_nodes)]
+	return [(s, t, (30,)) for s, t in zip(nodes[:-1], nodes[1:])]
+
+
+def geometry(indexed_edges):
+	return sorted((s[:2], t[:2]) for s, t, a in indexed_edges.values())
+
+
+def close(map1, map2, tolerance):
+	"""
+	Both maps have the same edges up to tolerance meters.
+	"""
+	g1, g2 = geometry(map1), geometry(map2)
+	if len(g1) != len(g2):
+		return False
+	for (s1, t1), (s2, t2) in zip(g1, g2):
+		for p1, p2 in ((s1, s2), (t1, t2)):
+			if max(abs(p1[0] - p2[0]) * 0.7460, abs(p1[1] - p2[1])) * METERS_PER_DEGREE > tolerance:
+				return False
+	return True
+
+
+def test_chained_deltas(tmpdir):
+	day1 = road(0) + road(1) + road(2)
+	day2 = road(0) + road(1, shift=3.0) + road(2) + road(3)
+	day3 = road(0)[:-2] + road(1, shift=6.0) + road(2) + road(3, shift=-3.0)
+	day4 = road(0)[:-2] + road(1, shift=3.0) + road(2) + road(3, shift=-3.0) + road(4)
+
+	producer = index_edges(day1)
+	consumer = index_edges(day1)
+	for day in (day2, day3, day4):
+		delta = diff_maps(producer, day)
+		apply_delta(producer, delta)
+		apply_delta(consumer, delta)
+		# the producer keeps its map on disk between runs.
+		write_map(producer, str(tmpdir.join('map.txt')))
+		producer = read_map(str(tmpdir.join('map.txt')))
+		assert consumer == producer
+		assert close(consumer, index_edges(day), NODE_ID_PRECISION)
+	assert len(consumer) == len(day4)
+
+
+def test_apply_delta_unknown_edge():
+	day1 = road(0) + road(1)
+	day2 = road(0)[:-1] + road(1)
+	delta = diff_maps(day1, day2)
+	assert len(delta['removed']) == 1
+	consumer = index_edges(day1)
+	apply_delta(consumer, delta)
+	with pytest.raises(KeyError):
+		apply_delta(consumer, delta)
+
+
+def two_way_road(nb_nodes=40):
+	"""
+	Edges of both directions of a road, 3 meters apart, as kharita.py builds them.
+	"""
+	westbound = [(t, s, a) for s, t, a in road(0, nb_nodes, shift=3.0, angle=270.0)]
+	return road(0, nb_nodes) + westbound
+
+
+def noisy(edges, noise, seed):
+	"""
+	The same edges, each node moved by gaussian noise of noise meters.
+	"""
+	rnd = np.random.RandomState(seed)
+	moved = {}
+	for s, t, a in edges:
+		for n in (s, t):
+			if n not in moved:
+				dx, dy = rnd.normal(0, noise, 2)
+				moved[n] = (round(n[0] + dx / (METERS_PER_DEGREE * 0.7460), 7), round(n[1] + dy / METERS_PER_DEGREE, 7), n[2])
+	return [(moved[s], moved[t], a) for s, t, a in edges]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_noisy_two_way_road(seed):
+	# the nearest node is often the one of the opposite direction, which must not prevent the match.
+	edges = two_way_road()
+	delta = diff_maps(edges, noisy(edges, 1.0, seed))
+	assert (delta['added'], delta['removed'], delta['changed']) == ([], [], [])
@@ -0,0 +1,12 @@
+import numpy as np
+from mapexport import rasterize
+
+
+def test_rasterize_longest_side():
+	north_south = np.array([[-87.65, 41.85, -87.65, 41.90]])
+	assert rasterize(north_south, width=512).shape == (512, 1)
+	east_west = np.array([[-87.70, 41.85, -87.60, 41.85]])
+	assert rasterize(east_west, width=512).shape == (1, 512)
+	img = rasterize(np.vstack([north_south, east_west]), width=512)
+	assert max(img.shape) == 512
+	assert img.sum() >= 512
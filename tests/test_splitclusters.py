@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from sklearn.neighbors import NearestNeighbors
+
+from methods_kharita import angledist, avgpoint, greaterthanangle, latconst, lonconst, point2cluster, splitclusters, \
+	splitclustersparallel
+
+
+def point2cluster_loop(datapointwts, seeds, theta):
+	# point2cluster before the vectorization: two ball trees and a loop over the points
+	cluster = {cd: [] for cd in range(len(seeds))}; p2cluster = []
+	X = [(lonconst * xx[0], latconst * xx[1], theta / 180 * xx[2]) for xx in datapointwts]
+	S = [(lonconst * xx[0], latconst * xx[1], theta / 180 * xx[2]) for xx in seeds]
+	Xrot = [(lonconst * xx[0], latconst * xx[1], theta / 180 * (xx[2] % 360)) for xx in datapointwts]
+	Srot = [(lonconst * xx[0], latconst * xx[1], theta / 180 * (xx[2] % 360)) for xx in seeds]
+	distances, indices = NearestNeighbors(n_neighbors=1, algorithm='ball_tree').fit(S).kneighbors(X)
+	distancesrot, indicesrot = NearestNeighbors(n_neighbors=1, algorithm='ball_tree').fit(Srot).kneighbors(Xrot)
+	for ii in range(len(datapointwts)):
+		cd = indices[ii][0] if distances[ii][0] < distancesrot[ii][0] else indicesrot[ii][0]
+		cluster[cd].append(datapointwts[ii])
+		p2cluster.append(cd)
+	return cluster, p2cluster
+
+
+def splitclusters_loop(datapointwts, seeds, theta):
+	# splitclusters before the vectorization: one pass per cluster
+	seeds1 = []; seedweight = []
+	cluster, p2cluster = point2cluster_loop(datapointwts, seeds, theta)
+	for cl in cluster:
+		mang = seeds[cl][-1]
+		if len(cluster[cl]) > 10:
+			std = np.percentile([angledist(xx[2], mang) for xx in cluster[cl]], 90)
+			clockwise = [xx for xx in cluster[cl] if greaterthanangle(xx[2], mang)]
+			if std > 20 and 0 < len(clockwise) < len(cluster[cl]):
+				seeds1.append(avgpoint(clockwise))
+				seeds1.append(avgpoint([xx for xx in cluster[cl] if not greaterthanangle(xx[2], mang)]))
+				seedweight.append(len(clockwise))
+				seedweight.append(len(cluster[cl]) - len(clockwise))
+				continue
+		seeds1.append(seeds[cl]); seedweight.append(len(cluster[cl]))
+	return seeds1, seedweight
+
+
+def city_points(seed):
+	# 40 seeds 300m apart with 0 to 40 points each, headings in -180..180 as returned by getdata. Half of the clusters
+	# mix two headings 60 degrees apart (divided road), the others have a single noisy heading.
+	rnd = np.random.RandomState(seed)
+	seeds = []; points = []
+	for k in range(40):
+		lon = -87.65 + (k % 8) * 300 / lonconst; lat = 41.87 + (k // 8) * 300 / latconst
+		angle = rnd.uniform(-180, 180)
+		seeds.append((lon, lat, angle))
+		for _ in range(rnd.randint(0, 40)):
+			heading = angle + (rnd.choice((-30, 30)) if k % 2 else 0) + rnd.normal(0, 10)
+			points.append((lon + rnd.normal(0, 10) / lonconst, lat + rnd.normal(0, 10) / latconst,
+						   (heading + 180) % 360 - 180, 30.0, len(points), 0.0))
+	return points, seeds
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_splitclusters_same_as_loop(seed):
+	points, seeds = city_points(seed)
+	assert point2cluster(points, seeds, 150) == point2cluster_loop(points, seeds, 150)
+	seeds1, weights = splitclusters(points, seeds, 150)
+	expected_seeds, expected_weights = splitclusters_loop(points, seeds, 150)
+	assert len(expected_seeds) > len(seeds)
+	assert weights == expected_weights
+	assert np.allclose(seeds1, expected_seeds, rtol=0, atol=1e-9)
+
+
+def test_splitclustersparallel_road_width():
+	# points spread orthogonally to the heading of their seed by +-spread meters (standard deviation spread) and
+	# along it by up to 20m, which must not count. The last seed has 10 points only.
+	seeds = []; points = []; widths = []
+	for k, (angle, spread, count) in enumerate([(0, 2.0, 20), (90, 3.5, 30), (-135, 1.0, 12), (30, 5.0, 10)]):
+		lon = -87.65 + k * 1000 / lonconst; lat = 41.87
+		seeds.append((lon, lat, angle))
+		a = np.radians(angle)
+		for i in range(count):
+			lateral = spread if i % 2 else -spread
+			along = 20.0 * i / count
+			dx = lateral * np.cos(a) + along * np.sin(a); dy = -lateral * np.sin(a) + along * np.cos(a)
+			points.append((lon + dx / lonconst, lat + dy / latconst, angle, 30.0, len(points), 0.0))
+		widths.append(1 + 5 * spread if count > 10 else 0)
+	assert splitclustersparallel(points, seeds, 150) == pytest.approx(widths, abs=1e-6)
+	labels = point2cluster(points, seeds, 150)[1]
+	assert splitclustersparallel(points, seeds, 150, labels) == pytest.approx(widths, abs=1e-6)